@@ -1,14 +1,52 @@
-import os, json
+import os, json, shutil, subprocess, sys
 
 import aws_cdk as cdk
 import aws_cdk.aws_iam as iam
 import aws_cdk.aws_iot as iot
+import aws_cdk.aws_lambda as lambda_
 import aws_cdk.aws_s3 as s3
 import aws_cdk.aws_timestream as ts
+import jsii
 from aws_cdk import RemovalPolicy
 
 from ...constructs.grafana import GrafanaConstruct
 
+# topics of the canAnalyzer payloads the CANData_to_Timestream rule cannot read, with the rule decoding them
+CAN_DECODE_RULES = {
+    "can-batch": "CANBatch_to_CANData",
+    "can-compact": "CANCompact_to_CANData",
+}
+
+
+@jsii.implements(cdk.ILocalBundling)
+class CopyBundling:
+    """Bundle an asset by copying files into it, without docker.
+
+    The packages of requirements are installed next to them for the Lambda Python 3.11 x86_64 runtime.
+    """
+
+    def __init__(self, paths, requirements=None):
+        self.paths = paths
+        self.requirements = requirements
+
+    def try_bundle(self, output_dir, *args, **kwargs):
+        for path in self.paths:
+            shutil.copy(path, output_dir)
+        if self.requirements:
+            subprocess.run(
+                [
+                    sys.executable, "-m", "pip", "install", "--quiet",
+                    "--requirement", self.requirements,
+                    "--target", output_dir,
+                    "--platform", "manylinux2014_x86_64",
+                    "--implementation", "cp",
+                    "--python-version", "3.11",
+                    "--only-binary=:all:",
+                ],
+                check=True,
+            )
+        return True
+
 
 class BigaObservabilityStack(cdk.Stack):
     def __init__(
@@ -175,6 +213,72 @@ class BigaObservabilityStack(cdk.Stack):
             table_dependent_rules.append(config_topic_rule)
         f.close()
 
+        # decode step of the batched and compact CAN payloads, republishing each record on the can topic
+        decoder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda")
+        can_decoder = lambda_.Function(
+            self,
+            "CANDecoderLambda",
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            handler="can_decoder.on_event",
+            code=lambda_.Code.from_asset(
+                decoder_path,
+                # the codec is the one of the component, hash the bundled files
+                asset_hash_type=cdk.AssetHashType.OUTPUT,
+                bundling=cdk.BundlingOptions(
+                    image=lambda_.Runtime.PYTHON_3_11.bundling_image,
+                    local=CopyBundling(
+                        [
+                            os.path.join(decoder_path, "can_decoder.py"),
+                            os.path.join(
+                                os.getcwd(),
+                                "../config/greengrass/can_data_analyzer_publisher/can_codec.py",
+                            ),
+                        ],
+                        # the backends of the compact formats
+                        requirements=os.path.join(decoder_path, "requirements.txt"),
+                    ),
+                ),
+            ),
+            timeout=cdk.Duration.seconds(60),
+        )
+        can_decoder.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["iot:DescribeEndpoint"],
+                resources=["*"],
+            )
+        )
+        can_decoder.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["iot:Publish"],
+                resources=[f"arn:aws:iot:{region}:{account}:topic/dt/*/embedded-metrics/*/can"],
+            )
+        )
+        for topic, rule_name in CAN_DECODE_RULES.items():
+            decode_rule = iot.CfnTopicRule(
+                self,
+                "observability-topic-rule-" + topic,
+                topic_rule_payload=iot.CfnTopicRule.TopicRulePayloadProperty(
+                    actions=[
+                        iot.CfnTopicRule.ActionProperty(
+                            lambda_=iot.CfnTopicRule.LambdaActionProperty(
+                                function_arn=can_decoder.function_arn
+                            )
+                        )
+                    ],
+                    sql="SELECT encode(*, 'base64') AS payload, topic() AS topic FROM 'dt/+/embedded-metrics/+/"
+                    + topic
+                    + "'",
+                    aws_iot_sql_version="2016-03-23",
+                    error_action=rule_error_action,
+                ),
+                rule_name=rule_name,
+            )
+            can_decoder.add_permission(
+                rule_name,
+                principal=iam.ServicePrincipal("iot.amazonaws.com"),
+                source_arn=decode_rule.attr_arn,
+            )
+
         # Greengrass telemetry rules
         ts_action_ggTelemetry = [
             iot.CfnTopicRule.ActionProperty(
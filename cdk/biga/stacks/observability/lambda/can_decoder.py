@@ -0,0 +1,49 @@
+"""Republish the records of CAN stats batches on the can topic of their device.
+
+The CANData_to_Timestream rule reads one JSON record per message on
+dt/+/embedded-metrics/+/can. The canAnalyzer component publishes JSON batches on can-batch
+and compact payloads (MessagePack or CBOR, optionally compressed) on can-compact instead,
+the rules of these topics invoke this function with the payload encoded in base64 and the
+topic it was published on.
+"""
+
+import base64
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import can_codec
+
+# publishes of one payload in flight at the same time
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "16"))
+
+_iot_data = None
+
+
+def iot_data():
+    global _iot_data
+    if _iot_data is None:
+        endpoint = boto3.client("iot").describe_endpoint(endpointType="iot:Data-ATS")["endpointAddress"]
+        _iot_data = boto3.client("iot-data", endpoint_url=f"https://{endpoint}")
+    return _iot_data
+
+
+def can_topic(topic):
+    return topic.rsplit("/", 1)[0] + "/can"
+
+
+def on_event(event, context):
+    records = can_codec.decodePayload(base64.b64decode(event["payload"]))
+    topic = can_topic(event["topic"])
+    client = iot_data()
+
+    def publish(record):
+        client.publish(topic=topic, qos=1, payload=json.dumps(record, separators=(",", ":")))
+
+    # a failed publish fails the invocation, which is retried with the whole payload
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(publish, records))
+    print(f"republished {len(records)} records on {topic}")
+    return {"records": len(records)}
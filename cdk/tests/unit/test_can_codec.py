@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../config/greengrass/can_data_analyzer_publisher"))
+
+import can_codec  # noqa: E402
+
+RECORDS = [
+    {
+        "id": i,
+        "ts_component": f"2024-01-01 00:00:00.{i:06d}",
+        "CANBaselineStats": {"frames": i * 10, "load": 0.25 * i, "bus": "can0", "errors": None},
+    }
+    for i in range(20)
+]
+
+FORMATS = [(encoding, compression) for encoding in can_codec.ENCODINGS for compression in can_codec.COMPRESSIONS]
+
+
+def lines(records):
+    return [json.dumps(record).encode() for record in records]
+
+
+def check_format(encoding, compression):
+    try:
+        can_codec.checkFormat(encoding, compression)
+    except RuntimeError as e:
+        pytest.skip(str(e))
+
+
+@pytest.mark.parametrize("encoding,compression", FORMATS)
+def test_round_trip(encoding, compression):
+    check_format(encoding, compression)
+    payload = can_codec.encodeBatch(lines(RECORDS), encoding, compression)
+    assert can_codec.decodePayload(payload) == RECORDS
+
+
+@pytest.mark.parametrize("encoding,compression", FORMATS)
+def test_round_trip_of_one_record(encoding, compression):
+    check_format(encoding, compression)
+    payload = can_codec.encodeBatch(lines(RECORDS[:1]), encoding, compression)
+    assert can_codec.decodePayload(payload) == RECORDS[:1]
+
+
+def test_plain_json_keeps_the_can_topic_format():
+    assert can_codec.encodeBatch(lines(RECORDS[:1])) == lines(RECORDS[:1])[0]
+    assert json.loads(can_codec.encodeJsonArray(lines(RECORDS))) == RECORDS
+
+
+def test_compact_payloads_are_smaller():
+    plain = can_codec.encodeJsonArray(lines(RECORDS))
+    assert len(can_codec.encodeBatch(lines(RECORDS), "json", "zlib")) < len(plain)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [b"CB", b"XX\x01\x00\x00{}", b"CB\x02\x00\x00[]", b"CB\x01\x09\x00[]"],
+)
+def test_invalid_payloads_are_rejected(payload):
+    with pytest.raises(ValueError):
+        can_codec.decodePayload(payload)
@@ -0,0 +1,60 @@
+import base64
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "../../biga/stacks/observability/lambda"))
+sys.path.insert(0, os.path.join(HERE, "../../../config/greengrass/can_data_analyzer_publisher"))
+
+import can_codec  # noqa: E402
+import can_decoder  # noqa: E402
+
+RECORDS = [
+    {"id": i, "ts_component": f"2024-01-01 00:00:00.{i:06d}", "CANBaselineStats": {"frames": i * 10, "load": 0.5}}
+    for i in range(5)
+]
+
+
+class StubIotData:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, qos, payload):
+        self.published.append((topic, json.loads(payload)))
+
+
+def republish(payload, topic):
+    stub = StubIotData()
+    can_decoder._iot_data = stub
+    event = {"payload": base64.b64encode(payload).decode(), "topic": topic}
+    response = can_decoder.on_event(event, None)
+    assert response == {"records": len(stub.published)}
+    return stub.published
+
+
+def lines(records):
+    return [json.dumps(record).encode() for record in records]
+
+
+def test_batch_is_republished_record_by_record_on_the_can_topic():
+    payload = can_codec.encodeJsonArray(lines(RECORDS))
+    published = republish(payload, "dt/pubCANdataPy/embedded-metrics/thing/can-batch")
+    assert {topic for topic, _ in published} == {"dt/pubCANdataPy/embedded-metrics/thing/can"}
+    assert sorted(published, key=lambda p: p[1]["id"]) == [
+        ("dt/pubCANdataPy/embedded-metrics/thing/can", record) for record in RECORDS
+    ]
+
+
+def test_batch_of_one_record():
+    payload = can_codec.encodeJsonArray(lines(RECORDS[:1]))
+    published = republish(payload, "dt/pubCANdataPy/embedded-metrics/thing/can-batch")
+    assert published == [("dt/pubCANdataPy/embedded-metrics/thing/can", RECORDS[0])]
+
+
+def test_compact_payload_is_republished_on_the_can_topic():
+    payload = can_codec.encodeBatch(lines(RECORDS), "json", "zlib")
+    published = republish(payload, "dt/pubCANdataPy/embedded-metrics/thing/can-compact")
+    assert sorted(published, key=lambda p: p[1]["id"]) == [
+        ("dt/pubCANdataPy/embedded-metrics/thing/can", record) for record in RECORDS
+    ]
@@ -0,0 +1,77 @@
+"""Local stand-in for the Greengrass IPC client, acknowledging PublishToIoTCore after a configurable latency."""
+
+import heapq
+import random
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+
+class PublishError(Exception):
+    pass
+
+
+class FakePublishOperation:
+    def __init__(self, client):
+        self.client = client
+        self.future = Future()
+
+    def activate(self, request):
+        self.client._schedule(self, request)
+        done = Future()
+        done.set_result(None)
+        return done
+
+    def get_response(self):
+        return self.future
+
+    def close(self):
+        pass
+
+
+class FakeIpcClient:
+    """Completes every publish ackLatencyMs (+/- jitterMs) after activate(), failing failureRate of them.
+
+    onAck(payload) is called for every acknowledged publish, from the acknowledging thread.
+    """
+
+    def __init__(self, ackLatencyMs=5.0, jitterMs=0.0, failureRate=0.0, onAck=None, seed=0):
+        self.ackLatency = ackLatencyMs / 1000.0
+        self.jitter = jitterMs / 1000.0
+        self.failureRate = failureRate
+        self.onAck = onAck
+        self.random = random.Random(seed)
+        self.heap = []
+        self.sequence = 0
+        self.cond = threading.Condition()
+        self.published = 0
+        self.failed = 0
+        threading.Thread(target=self._complete, daemon=True).start()
+
+    def new_publish_to_iot_core(self):
+        return FakePublishOperation(self)
+
+    def _schedule(self, operation, request):
+        with self.cond:
+            latency = max(0.0, self.ackLatency + self.random.uniform(-self.jitter, self.jitter))
+            fail = self.random.random() < self.failureRate
+            self.sequence += 1
+            heapq.heappush(self.heap, (monotonic() + latency, self.sequence, operation, request.payload, fail))
+            self.cond.notify()
+
+    def _complete(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > monotonic():
+                    self.cond.wait(self.heap[0][0] - monotonic() if self.heap else None)
+                _, _, operation, payload, fail = heapq.heappop(self.heap)
+                if fail:
+                    self.failed += 1
+                else:
+                    self.published += 1
+            if fail:
+                operation.future.set_exception(PublishError("injected publish failure"))
+                continue
+            if self.onAck is not None:
+                self.onAck(payload)
+            operation.future.set_result(None)
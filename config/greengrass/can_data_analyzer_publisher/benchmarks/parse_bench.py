@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Compare the serial line parsing of can_publisher.collectData against the original round-trip.
+
+    python3 parse_bench.py [--lines 100000] [--input recorded.jsonl]
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import can_publisher  # noqa: E402
+from samples import canStatsLines, loadLines  # noqa: E402
+
+
+def roundTrip(line, id):
+    # the per line processing collectData used to do
+    dictData = json.loads(line.decode())
+    dictData["ts_component"] = str(datetime.now())
+    dictData["id"] = "4" + str(id)
+    return json.dumps(dictData).encode()
+
+
+def run(name, fn, lines, repeat, baseline=None):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for i, line in enumerate(lines):
+            fn(line, i)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rate = len(lines) / best
+    speedup = f"  x{rate / baseline:.2f}" if baseline else ""
+    print(f"{name:<28} {rate:>12,.0f} lines/s  {best / len(lines) * 1e6:6.2f} us/line{speedup}")
+    return rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100000, help='Number of synthetic lines')
+    parser.add_argument('--input', type=str, help='File of recorded serial lines to use instead')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per variant, the fastest one is reported')
+    args = parser.parse_args()
+
+    lines = loadLines(args.input) if args.input else canStatsLines(args.lines)
+    print(f"{len(lines)} lines, JSON backend: {can_publisher.jsonLoads.__module__}")
+
+    baseline = run("decode/encode round-trip", roundTrip, lines, args.repeat)
+    for name, validate in (("stampRecord", True), ("stampRecord --no-validate", False)):
+        run(name, lambda line, i: can_publisher.stampRecord(line, i, validate), lines, args.repeat, baseline)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Measure can_publisher.py end to end without a serial device nor a Greengrass nucleus.
+
+CAN stats lines, synthetic or recorded, are written at a fixed rate to one side of a
+pseudo-terminal while collectData reads the other side. sendData publishes to a
+FakeIpcClient acknowledging after a configurable latency. The publisher options are the
+ones of can_publisher.py.
+
+    python3 replay_bench.py --rate 2000 --duration 30 --ack-latency-ms 20 --max-inflight 16 --batch-max-records 50
+
+Requires pyserial and awsiotsdk, like the component itself.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import threading
+import tty
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import can_codec  # noqa: E402
+import can_publisher  # noqa: E402
+from fake_ipc import FakeIpcClient  # noqa: E402
+from samples import canStatsLines, loadLines  # noqa: E402
+
+
+class LatencyRecorder:
+    """Collects write-to-acknowledgement latencies, records are matched on the id stamped by collectData."""
+
+    def __init__(self):
+        self.sentAt = {}
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def sent(self, seq):
+        self.sentAt[seq] = monotonic()
+
+    def acked(self, payload):
+        now = monotonic()
+        records = can_codec.decodePayload(payload)
+        with self.lock:
+            for record in records:
+                # collectData numbers the records "4<n>", n counting from 1
+                sentAt = self.sentAt.pop(int(record['id'][1:]) - 1, None)
+                if sentAt is not None:
+                    self.latencies.append(now - sentAt)
+
+    def percentile(self, values, p):
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def summary(self):
+        with self.lock:
+            values = sorted(self.latencies)
+        if not values:
+            return "no acknowledged records"
+        return "  ".join(f"{name} {self.percentile(values, p) * 1000:.1f}ms"
+                         for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)))
+
+
+def writeLines(fd, lines, rate, duration, recorder):
+    # paced writer, rate 0 writes as fast as the pty accepts
+    start = monotonic()
+    seq = 0
+    while monotonic() - start < duration:
+        line = lines[seq % len(lines)]
+        if rate:
+            delay = start + seq / rate - monotonic()
+            if delay > 0:
+                sleep(delay)
+        recorder.sent(seq)
+        os.write(fd, line)
+        seq += 1
+    return seq
+
+
+def rssBytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=1000, help='Lines written per second, 0 for as fast as possible')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of writing')
+    parser.add_argument('--drain', type=float, default=5, help='Seconds left to the publisher to catch up')
+    parser.add_argument('--input', type=str, help='File of recorded serial lines, replayed in a loop')
+    parser.add_argument('--ack-latency-ms', type=float, default=10, help='Acknowledgement latency of the fake IPC client')
+    parser.add_argument('--ack-jitter-ms', type=float, default=0, help='Random +/- variation of the acknowledgement latency')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of publishes failing')
+    parser.add_argument('--batch-max-records', type=int, default=1)
+    parser.add_argument('--batch-max-bytes', type=int, default=can_publisher.DEFAULT_BATCH_MAX_BYTES)
+    parser.add_argument('--batch-linger-ms', type=int, default=0)
+    parser.add_argument('--max-inflight', type=int, default=1)
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--retry-backoff-ms', type=int, default=100)
+    parser.add_argument('--queue-capacity', type=int, default=10000)
+    parser.add_argument('--overflow-policy', choices=('block', 'drop-oldest', 'drop-newest'), default='block')
+    parser.add_argument('--encoding', choices=can_codec.ENCODINGS, default='json')
+    parser.add_argument('--compression', choices=can_codec.COMPRESSIONS, default='none')
+    parser.add_argument('--no-validate', dest='validate', action='store_false')
+    args = parser.parse_args()
+
+    lines = loadLines(args.input) if args.input else canStatsLines(10000)
+    recorder = LatencyRecorder()
+    client = FakeIpcClient(args.ack_latency_ms, args.ack_jitter_ms, args.failure_rate, onAck=recorder.acked)
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    queue = can_publisher.RecordQueue(args.queue_capacity, args.overflow_policy)
+    threading.Thread(target=can_publisher.collectData, args=(queue, os.ttyname(slave), args.validate),
+                     daemon=True).start()
+    threading.Thread(target=can_publisher.sendData,
+                     args=(queue, args.batch_max_records, args.batch_max_bytes, args.batch_linger_ms,
+                           args.max_inflight, args.max_retries, args.retry_backoff_ms, 0,
+                           args.encoding, args.compression, client),
+                     daemon=True).start()
+    sleep(0.5)  # let the reader open the pty
+
+    cpuStart = resource.getrusage(resource.RUSAGE_SELF)
+    start = monotonic()
+    written = writeLines(master, lines, args.rate, args.duration, recorder)
+    writeTime = monotonic() - start
+    deadline = monotonic() + args.drain
+    while recorder.sentAt and monotonic() < deadline:
+        sleep(0.05)
+    elapsed = monotonic() - start
+    cpuEnd = resource.getrusage(resource.RUSAGE_SELF)
+
+    acked = len(recorder.latencies)
+    cpu = (cpuEnd.ru_utime - cpuStart.ru_utime) + (cpuEnd.ru_stime - cpuStart.ru_stime)
+    print(f"written      {written} lines in {writeTime:.1f}s ({written / writeTime:,.0f} lines/s)")
+    print(f"acknowledged {acked} records, {client.published} publishes, {client.failed} injected failures")
+    print(f"throughput   {acked / elapsed:,.0f} records/s sustained over {elapsed:.1f}s")
+    print(f"latency      {recorder.summary()}")
+    print(f"cpu          {cpu:.2f}s ({cpu / elapsed * 100:.0f}% of one core, harness included)")
+    print(f"rss          {rssBytes() / 1048576:.1f} MiB (peak {cpuEnd.ru_maxrss / 1024:.1f} MiB)")
+    print(f"queue        {queue.stats()}")
@@ -0,0 +1,31 @@
+"""Synthetic CAN stats lines, shaped like the CANBaselineStats records the serial port delivers."""
+
+import json
+import random
+from datetime import datetime
+
+
+def canStatsLine(seq, rng=random):
+    record = {
+        "name": "CAN_Stats",
+        "ts_device": str(datetime.now()),
+        "CANBaselineStats": {
+            "CANDataLoad": round(rng.uniform(0, 100), 2),
+            "CANDataThroughput": rng.randint(0, 500000),
+            "MessagesReceivedCount": rng.randint(0, 5000),
+            "MessagesTransmittedCount": rng.randint(0, 5000),
+            "Sequence": seq,
+        },
+    }
+    return json.dumps(record).encode() + b'\n'
+
+
+def canStatsLines(count, seed=0):
+    rng = random.Random(seed)
+    return [canStatsLine(i, rng) for i in range(count)]
+
+
+def loadLines(path):
+    """Read recorded serial lines, one JSON object per line."""
+    with open(path, 'rb') as f:
+        return [line if line.endswith(b'\n') else line + b'\n' for line in f if line.strip()]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Wire formats of the CAN embedded-metrics payloads published by can_publisher.py.
+
+The default format is plain JSON: a single record object, or an array of records when
+batching. The
+compact formats start with a 5 bytes header (magic, version, encoding, compression) and
+carry the batch of records encoded with MessagePack or CBOR, optionally compressed.
+decodePayload() accepts every format and returns the records as dicts, exactly as the
+plain JSON payload would have carried them, so a decode step in front of the
+CANData_to_Timestream rule can republish them unchanged.
+
+The MessagePack, CBOR and snappy backends are optional (msgpack, cbor2, python-snappy).
+"""
+
+import importlib
+import json
+import struct
+import zlib
+
+# use the fastest JSON parser installed
+try:
+    import orjson
+    jsonLoads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        jsonLoads = ujson.loads
+    except ImportError:
+        jsonLoads = json.loads
+
+MAGIC = b'CB'
+VERSION = 1
+HEADER = struct.Struct('<2sBBB')
+
+ENCODINGS = ('json', 'msgpack', 'cbor')
+COMPRESSIONS = ('none', 'zlib', 'snappy')
+
+# module providing each optional backend
+BACKENDS = {'msgpack': 'msgpack', 'cbor': 'cbor2', 'snappy': 'snappy'}
+
+
+def backend(name):
+    module = BACKENDS.get(name)
+    if module is None:
+        return None
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise RuntimeError(f"the {name} format requires the {module} module, install it with pip") from None
+
+
+def checkFormat(encoding, compression):
+    """Fail early when the selected format is unknown or its backend is missing."""
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown encoding {encoding}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression}")
+    backend(encoding)
+    backend(compression)
+
+
+def isPlainJson(encoding, compression):
+    return encoding == 'json' and compression == 'none'
+
+
+def encodeJson(records):
+    # a single record is published as-is, several records become a JSON array
+    if len(records) == 1:
+        return records[0]
+    return encodeJsonArray(records)
+
+
+def encodeJsonArray(records):
+    return b'[' + b','.join(records) + b']'
+
+
+def encodeBatch(records, encoding='json', compression='none'):
+    """Encode a batch of JSON object lines (bytes) into one payload."""
+    if isPlainJson(encoding, compression):
+        return encodeJson(records)
+    if encoding == 'json':
+        body = encodeJsonArray(records)
+    else:
+        objects = [jsonLoads(record) for record in records]
+        if encoding == 'msgpack':
+            body = backend('msgpack').packb(objects, use_bin_type=True)
+        else:
+            body = backend('cbor').dumps(objects)
+    if compression == 'zlib':
+        body = zlib.compress(body)
+    elif compression == 'snappy':
+        body = backend('snappy').compress(body)
+    return HEADER.pack(MAGIC, VERSION, ENCODINGS.index(encoding), COMPRESSIONS.index(compression)) + body
+
+
+def decodePayload(payload):
+    """Return the list of records carried by a payload of any supported format."""
+    if payload[:1] in (b'{', b'['):
+        decoded = jsonLoads(payload)
+        return decoded if isinstance(decoded, list) else [decoded]
+    if len(payload) < HEADER.size:
+        raise ValueError("payload too short")
+    magic, version, encodingId, compressionId = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("not a CAN embedded-metrics payload")
+    if version != VERSION:
+        raise ValueError(f"unsupported payload version {version}")
+    if encodingId >= len(ENCODINGS) or compressionId >= len(COMPRESSIONS):
+        raise ValueError(f"unknown payload format {encodingId}/{compressionId}")
+    encoding = ENCODINGS[encodingId]
+    compression = COMPRESSIONS[compressionId]
+    body = payload[HEADER.size:]
+    if compression == 'zlib':
+        body = zlib.decompress(body)
+    elif compression == 'snappy':
+        body = backend('snappy').decompress(body)
+    if encoding == 'json':
+        return jsonLoads(body)
+    if encoding == 'msgpack':
+        return backend('msgpack').unpackb(body, raw=False)
+    return backend('cbor').loads(body)
+
+
+if __name__ == '__main__':
+    # decode payloads saved to files, one JSON record per output line
+    import sys
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            for record in decodePayload(f.read()):
+                print(json.dumps(record))
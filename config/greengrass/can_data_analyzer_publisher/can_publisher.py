@@ -1,70 +1,545 @@
 #!/usr/bin/env python3
 
-import json
 import serial
 import awsiot.greengrasscoreipc
 import awsiot.greengrasscoreipc.model as model
-from time import sleep
+from time import sleep, monotonic
 from datetime import datetime
 import threading
 from collections import deque
 import os
 import argparse  # Import the argparse module
+import can_codec
+from can_codec import jsonLoads
 
 THING_NAME = os.getenv('AWS_IOT_THING_NAME', '')
 
-def collectData(queue, serial_port):
+# IoT Core rejects MQTT payloads above 128 KB, keep some headroom for the MQTT framing
+MAX_PAYLOAD_BYTES = 128 * 1024
+DEFAULT_BATCH_MAX_BYTES = MAX_PAYLOAD_BYTES - 1024
+
+MAX_RETRY_BACKOFF = 60.0
+
+SERIAL_BAUDRATE = 115200
+SERIAL_READ_TIMEOUT = 1.0
+SERIAL_CHUNK_BYTES = 4096
+SERIAL_MAX_LINE_BYTES = 65536
+SERIAL_RETRY_MIN = 0.5
+SERIAL_RETRY_MAX = 30.0
+
+# counters of the serial reader thread, printed with the queue and publisher ones
+serialStats = {'lines': 0, 'malformed': 0, 'reconnects': 0}
+
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop-newest', 'spill')
+
+class Spool:
+    """Append-only on-disk spool made of rotated segment files, replayed oldest record first.
+
+    Follows the FleetWise Edge persistency settings: a segment is closed once it reaches
+    segmentMaxBytes and the oldest segments are evicted when the spool exceeds maxBytes.
+    Segments left by a previous run are picked up again at startup.
+    """
+
+    def __init__(self, path, segmentMaxBytes=524288, maxBytes=67108864):
+        self.path = path
+        self.segmentMaxBytes = segmentMaxBytes
+        self.maxBytes = maxBytes
+        os.makedirs(path, exist_ok=True)
+        # oldest segment first, each entry is [sequence, bytes, unread records]
+        self.segments = deque()
+        self.count = 0
+        self.bytes = 0
+        self.evicted = 0
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.seg'):
+                with open(os.path.join(path, name), 'rb') as f:
+                    data = f.read()
+                records = data.count(b'\n')
+                if records == 0:
+                    # a segment opened or partly written just before a power cut, nothing to replay
+                    os.remove(os.path.join(path, name))
+                    continue
+                self.segments.append([int(name[:-4]), len(data), records])
+                self.count += records
+                self.bytes += len(data)
+        self.writer = None
+        self.reader = None
+        if self.count:
+            print(f"spool: recovered {self.count} records from {len(self.segments)} segments")
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        line = record + b'\n'
+        if self.writer is None or self.segments[-1][1] + len(line) > self.segmentMaxBytes:
+            self._rotate()
+        self.writer.write(line)
+        self.writer.flush()
+        self.segments[-1][1] += len(line)
+        self.segments[-1][2] += 1
+        self.count += 1
+        self.bytes += len(line)
+        while self.bytes > self.maxBytes and len(self.segments) > 1:
+            self._evictOldest()
+
+    def read(self, maxRecords):
+        records = []
+        while len(records) < maxRecords and self.count:
+            segment = self.segments[0]
+            if self.reader is None:
+                self.reader = open(self._segmentPath(segment[0]), 'rb')
+            line = self.reader.readline()
+            if not line:
+                if self.writer is not None and len(self.segments) == 1:
+                    # caught up with the segment being written
+                    break
+                # the end of a segment with fewer records than counted, a truncated file
+                self._deleteOldest()
+                continue
+            if line.endswith(b'\n'):
+                records.append(line[:-1])
+                segment[2] -= 1
+                self.count -= 1
+            if segment[2] == 0:
+                self._deleteOldest()
+        return records
+
+    def _segmentPath(self, sequence):
+        return os.path.join(self.path, f'{sequence:020d}.seg')
+
+    def _rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        sequence = self.segments[-1][0] + 1 if self.segments else 0
+        self.segments.append([sequence, 0, 0])
+        self.writer = open(self._segmentPath(sequence), 'ab')
+
+    def _deleteOldest(self):
+        sequence, size, records = self.segments.popleft()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.writer is not None and not self.segments:
+            # the segment being written was fully replayed, the next append starts a new one
+            self.writer.close()
+            self.writer = None
+        self.count -= records
+        self.bytes -= size
+        os.remove(self._segmentPath(sequence))
+
+    def _evictOldest(self):
+        records = self.segments[0][2]
+        self._deleteOldest()
+        self.evicted += records
+        print(f"spool: size limit reached, evicted {records} records")
+
+class RecordQueue:
+    """Bounded, blocking producer/consumer channel between the serial reader and the publisher.
+
+    When the queue is full, put() applies the overflow policy: 'block' waits for room,
+    'drop-oldest' evicts the oldest record and 'drop-newest' discards the new one. With the
+    'spill' policy records go to the on-disk spool as soon as spoolThreshold records are
+    queued, and are replayed in order once the consumer caught up.
+    """
+
+    def __init__(self, capacity, policy='block', spool=None, spoolThreshold=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {policy}")
+        if policy == 'spill' and spool is None:
+            raise ValueError("the spill policy requires a spool")
+        self.capacity = capacity
+        self.policy = policy
+        self.records = deque()
+        self.spill = spool if policy == 'spill' else None
+        self.spoolThreshold = min(spoolThreshold or capacity, capacity)
+        self.limit = self.spoolThreshold if self.spill is not None else capacity
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.spilled = 0
+        self.requeued = 0
+        self.highWater = 0
+
+    def put(self, record):
+        with self.cond:
+            if len(self.records) >= self.limit or (self.spill is not None and len(self.spill) > 0):
+                if self.policy == 'block':
+                    while len(self.records) >= self.capacity:
+                        self.cond.wait()
+                elif self.policy == 'drop-oldest':
+                    self.records.popleft()
+                    self.dropped += 1
+                elif self.policy == 'drop-newest':
+                    self.dropped += 1
+                    return
+                else:
+                    # once something was spilled, newer records follow it to keep the order
+                    self.spill.append(record)
+                    self.spilled += 1
+                    # the consumer reads the spool when the queue is empty
+                    self.cond.notify_all()
+                    return
+            self.records.append(record)
+            if len(self.records) > self.highWater:
+                self.highWater = len(self.records)
+            self.cond.notify_all()
+
+    def _spooled(self):
+        return self.spill is not None and len(self.spill) > 0
+
+    def get(self, timeout=None):
+        """Return the oldest record, or None when none arrived within timeout seconds."""
+        with self.cond:
+            while True:
+                if not self.records and self._spooled():
+                    self.records.extend(self.spill.read(self.spoolThreshold))
+                if self.records:
+                    break
+                if not self.cond.wait_for(lambda: self.records or self._spooled(), timeout):
+                    return None
+            record = self.records.popleft()
+            self.cond.notify_all()
+            return record
+
+    def stats(self):
+        with self.cond:
+            return {
+                'queued': len(self.records),
+                'spooled': len(self.spill) if self.spill is not None else 0,
+                'spooledBytes': self.spill.bytes if self.spill is not None else 0,
+                'highWater': self.highWater,
+                'dropped': self.dropped + (self.spill.evicted if self.spill is not None else 0),
+                'spilled': self.spilled,
+                'requeued': self.requeued,
+            }
+
+    def putFailed(self, batch):
+        """Queue again the records of a publish that failed for good, if there is a spool.
+
+        They are older than every queued or spooled record, so they go back to the front of
+        the queue, over capacity if need be. Records of later batches that were already
+        acknowledged when the failure came with maxInflight > 1 stay published before them.
+        """
+        with self.cond:
+            if self.spill is None:
+                return False
+            self.records.extendleft(reversed(batch))
+            self.requeued += len(batch)
+            self.cond.notify_all()
+            return True
+
+def stampRecord(line, id, validate=True):
+    """Add the ts_component and id fields to a raw JSON object line without re-serializing it.
+
+    Only the object framing is checked, unless validate is set, in which case the line is
+    also parsed. Fields already present in the line are not removed, the appended ones come
+    last and win with JSON parsers keeping the last duplicate key, like the IoT rules engine.
+    """
+    line = line.strip()
+    if line[:1] != b'{' or line[-1:] != b'}':
+        raise ValueError(f"not a JSON object: {line[:32]!r}")
+    if validate:
+        jsonLoads(line)
+    fields = b'"ts_component":"%s","id":"4%d"}' % (str(datetime.now()).encode(), id)
+    body = line[:-1].rstrip()
+    if body == b'{':
+        return body + fields
+    return body + b',' + fields
+
+class SerialBackoff:
+    """Exponential backoff between serial reconnects, kept across reconnects until a read succeeds."""
+
+    def __init__(self):
+        self.delay = SERIAL_RETRY_MIN
+
+    def wait(self, reason):
+        print(f"{reason}, retry in {self.delay:.1f} seconds")
+        sleep(self.delay)
+        self.delay = min(self.delay * 2, SERIAL_RETRY_MAX)
+
+    def reset(self):
+        self.delay = SERIAL_RETRY_MIN
+
+def openSerial(serial_port, backoff):
+    # retry until the port can be opened
+    while True:
+        try:
+            print("connecting to serial")
+            ser = serial.Serial(serial_port, SERIAL_BAUDRATE, timeout=SERIAL_READ_TIMEOUT)
+            print("connected to serial ")
+            return ser
+        except (serial.SerialException, OSError) as e:
+            backoff.wait(f"Failed to connect to serial: {e}")
+
+def readLines(ser):
+    """Yield the complete lines received on the port, reading whatever the driver buffered at once."""
+    buffer = bytearray()
+    while True:
+        chunk = ser.read(min(max(ser.in_waiting, 1), SERIAL_CHUNK_BYTES))
+        if not chunk:
+            continue
+        start = len(buffer)
+        buffer += chunk
+        # only the new bytes can hold a line end
+        end = buffer.find(b'\n', start)
+        if end < 0:
+            if len(buffer) > SERIAL_MAX_LINE_BYTES:
+                # no line end in sight, most likely noise on the line
+                serialStats['malformed'] += 1
+                del buffer[:]
+            continue
+        start = 0
+        while end >= 0:
+            yield bytes(buffer[start:end])
+            start = end + 1
+            end = buffer.find(b'\n', start)
+        del buffer[:start]
+
+def collectData(queue, serial_port, validate=True):
     id=1
     print("collectData")
-    try:
-        print("connecting to serial")
-        ser = serial.Serial(serial_port, 115200)  # Use the serial_port argument
-        print("connected to serial ")
-    except:
-        print("Failed to connect to serial, should retry \n")
+    # a port that opens but fails its first read must not be reopened in a tight loop
+    backoff = SerialBackoff()
     while True:
+        ser = openSerial(serial_port, backoff)
+        reading = False
         try:
-            can_data = ser.readline().decode()
-            dictData = json.loads(can_data)
-            dictData["ts_component"] = str(datetime.now())
-            dictData["id"] = "4" + str(id)
-            jsonData = json.dumps(dictData)
-            queue.append(jsonData)
-            id += 1
-        except Exception as se:
-            print("Failed to connect to read from serial", se)
+            for line in readLines(ser):
+                if not reading:
+                    backoff.reset()
+                    reading = True
+                if not line.strip():
+                    continue
+                try:
+                    record = stampRecord(line, id, validate)
+                except ValueError:
+                    # a garbled line is skipped, the port itself is fine
+                    serialStats['malformed'] += 1
+                    continue
+                queue.put(record)
+                serialStats['lines'] += 1
+                id += 1
+        except (serial.SerialException, OSError) as se:
+            serialStats['reconnects'] += 1
             try:
-                ser = serial.Serial(serial_port, 115200)  # Use the serial_port argument
-            except:
-                print("Serial broken, retry in 2 seconds")
-                sleep(2)
+                ser.close()
+            except Exception:
+                pass
+            backoff.wait(f"Failed to read from serial: {se}")
 
-def sendData(queue):
-    ipc_client = awsiot.greengrasscoreipc.connect()
-    while True:
-        while len(queue) != 0:
-            topic= f'dt/pubCANdataPy/embedded-metrics/{THING_NAME}/can'
-            op = ipc_client.new_publish_to_iot_core()
-            msg = queue.popleft().encode()
+class PipelinedPublisher:
+    """Keeps up to maxInflight PublishToIoTCore operations in flight on the IPC connection.
+
+    Responses are reaped in publish order by a background thread, a failed or timed out
+    publish is retried with exponential backoff while keeping its window slot, so a
+    failing connection applies back pressure on the caller instead of piling up requests.
+    A negative maxRetries retries forever, onFailed receives the batches given up on.
+    """
+
+    def __init__(self, ipc_client, topic, maxInflight=1, maxRetries=3, retryBackoffMs=500, ackTimeout=10.0,
+                 onFailed=None, encode=can_codec.encodeJson):
+        self.ipc_client = ipc_client
+        self.topic = topic
+        self.encode = encode
+        self.onFailed = onFailed
+        self.maxRetries = maxRetries
+        self.retryBackoff = retryBackoffMs / 1000.0
+        self.ackTimeout = ackTimeout
+        self.window = threading.BoundedSemaphore(maxInflight)
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.acked = 0
+        self.ackedRecords = 0
+        self.retried = 0
+        self.failed = 0
+        self.failedRecords = 0
+        threading.Thread(target=self._reap, daemon=True).start()
+
+    def publish(self, batch):
+        # blocks while the window is full
+        self.window.acquire()
+        with self.cond:
+            self.inflight += 1
+        self._send(batch, 0)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'inflight': self.inflight,
+                'acked': self.acked,
+                'ackedRecords': self.ackedRecords,
+                'retried': self.retried,
+                'failed': self.failed,
+                'failedRecords': self.failedRecords,
+            }
+
+    def _send(self, batch, attempt):
+        try:
+            op = self.ipc_client.new_publish_to_iot_core()
             op.activate(model.PublishToIoTCoreRequest(
-                topic_name=topic,
+                topic_name=self.topic,
                 qos=model.QOS.AT_LEAST_ONCE,
-                payload=msg,
+                payload=self.encode(batch),
             ))
+            future = op.get_response()
+        except Exception as e:
+            self._onFailure(batch, attempt, e)
+            return
+        with self.cond:
+            self.pending.append((future, monotonic() + self.ackTimeout, batch, attempt))
+            self.cond.notify()
+
+    def _reap(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                future, deadline, batch, attempt = self.pending.popleft()
             try:
-                result = op.get_response().result(timeout=10.0)
-                # print("successfully published message:", result)
+                future.result(timeout=max(0.0, deadline - monotonic()))
             except Exception as e:
-                print("failed to publish message:", e)
+                self._onFailure(batch, attempt, e)
+                continue
+            with self.cond:
+                self.inflight -= 1
+                self.acked += 1
+                self.ackedRecords += len(batch)
+            self.window.release()
+
+    def _onFailure(self, batch, attempt, error):
+        if self.maxRetries < 0 or attempt < self.maxRetries:
+            delay = min(self.retryBackoff * (2 ** min(attempt, 16)), MAX_RETRY_BACKOFF)
+            print(f"failed to publish {len(batch)} message(s), retry {attempt + 1} in {delay:.1f}s:", error)
+            with self.cond:
+                self.retried += 1
+            retry = threading.Timer(delay, self._send, args=(batch, attempt + 1))
+            retry.daemon = True
+            retry.start()
+            return
+        print(f"failed to publish {len(batch)} message(s), giving up after {attempt + 1} attempts:", error)
+        with self.cond:
+            self.inflight -= 1
+            self.failed += 1
+            self.failedRecords += len(batch)
+        self.window.release()
+        if self.onFailed is not None:
+            self.onFailed(batch)
+
+def reportStats(queue, publisher, interval):
+    while True:
+        sleep(interval)
+        print("serial stats:", serialStats)
+        print("queue stats:", queue.stats())
+        print("publisher stats:", publisher.stats())
+
+def sendData(queue, batchMaxRecords=1, batchMaxBytes=DEFAULT_BATCH_MAX_BYTES, batchLingerMs=0,
+             maxInflight=1, maxRetries=3, retryBackoffMs=500, statsInterval=60, encoding='json', compression='none',
+             ipc_client=None):
+    if ipc_client is None:
+        ipc_client = awsiot.greengrasscoreipc.connect()
+    if can_codec.isPlainJson(encoding, compression) and batchMaxRecords == 1:
+        topic = f'dt/pubCANdataPy/embedded-metrics/{THING_NAME}/can'
+        encode = can_codec.encodeJson
+    elif can_codec.isPlainJson(encoding, compression):
+        # the CANData_to_Timestream rule cannot read the fields of an array, batches go through the
+        # same decode step as the compact payloads
+        topic = f'dt/pubCANdataPy/embedded-metrics/{THING_NAME}/can-batch'
+        encode = can_codec.encodeJsonArray
+    else:
+        # compact payloads go through a decode step before reaching the CANData_to_Timestream rule
+        topic = f'dt/pubCANdataPy/embedded-metrics/{THING_NAME}/can-compact'
+        encode = lambda batch: can_codec.encodeBatch(batch, encoding, compression)
+    publisher = PipelinedPublisher(ipc_client, topic, maxInflight, maxRetries, retryBackoffMs,
+                                   onFailed=queue.putFailed, encode=encode)
+    if statsInterval > 0:
+        threading.Thread(target=reportStats, args=(queue, publisher, statsInterval), daemon=True).start()
+    batchLinger = batchLingerMs / 1000.0
+    batch = []
+    batchBytes = 0
+    batchStart = 0.0
+    while True:
+        # a partial batch waits at most batchLinger for more records
+        timeout = max(0.0, batchStart + batchLinger - monotonic()) if batch else None
+        msg = queue.get(timeout)
+        if msg is None:
+            publisher.publish(batch)
+            batch = []
+            continue
+        # a record is never split, flush first when it would push the array over the size limit
+        # (+1 for the separating comma)
+        if batch and batchBytes + len(msg) + 1 > batchMaxBytes:
+            publisher.publish(batch)
+            batch = []
+        if not batch:
+            batchStart = monotonic()
+            batchBytes = 2  # enclosing brackets
+        batch.append(msg)
+        batchBytes += len(msg) + 1
+        if len(batch) >= batchMaxRecords:
+            publisher.publish(batch)
+            batch = []
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Serial port reader.')
     parser.add_argument('serial_port', type=str, help='Serial port to connect to (e.g., /dev/ttyLF1)')
+    parser.add_argument('--batch-max-records', type=int, default=1,
+                        help='Maximum number of records packed into one MQTT payload (1 disables batching)')
+    parser.add_argument('--batch-max-bytes', type=int, default=DEFAULT_BATCH_MAX_BYTES,
+                        help=f'Maximum size in bytes of a batched payload (at most {MAX_PAYLOAD_BYTES})')
+    parser.add_argument('--batch-linger-ms', type=int, default=0,
+                        help='Maximum time a partial batch waits for more records before being published')
+    parser.add_argument('--max-inflight', type=int, default=1,
+                        help='Maximum number of publishes waiting for an acknowledgement')
+    parser.add_argument('--max-retries', type=int, default=3,
+                        help='Number of times a failed publish is retried before it is dropped or spooled (-1 retries forever)')
+    parser.add_argument('--retry-backoff-ms', type=int, default=500,
+                        help='Delay before the first retry of a failed publish, doubled on every attempt')
+    parser.add_argument('--queue-capacity', type=int, default=10000,
+                        help='Maximum number of records buffered in memory between the serial reader and the publisher')
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default='block',
+                        help='What to do with a new record when the queue is full')
+    parser.add_argument('--spool-path', type=str, default='/tmp/canAnalyzer/spool/',
+                        help='Directory of the on-disk spool used by the spill policy')
+    parser.add_argument('--spool-threshold', type=int, default=None,
+                        help='Number of queued records above which new records go to the spool (defaults to the queue capacity)')
+    parser.add_argument('--spool-segment-max-bytes', type=int, default=524288,
+                        help='Size at which a spool segment file is closed and a new one started')
+    parser.add_argument('--spool-max-bytes', type=int, default=67108864,
+                        help='Maximum size of the spool, the oldest segments are evicted beyond it')
+    parser.add_argument('--encoding', choices=can_codec.ENCODINGS, default='json',
+                        help='Encoding of the published records, anything but plain JSON goes to the can-compact topic')
+    parser.add_argument('--compression', choices=can_codec.COMPRESSIONS, default='none',
+                        help='Compression applied to each published batch')
+    parser.add_argument('--no-validate', dest='validate', action='store_false',
+                        help='Only check that serial lines look like JSON objects instead of parsing them')
+    parser.add_argument('--stats-interval', type=int, default=60,
+                        help='Seconds between two prints of the serial, queue and publisher counters (0 disables them)')
     args = parser.parse_args()
 
+    if args.batch_max_records < 1:
+        parser.error('--batch-max-records must be at least 1')
+    if not 0 < args.batch_max_bytes <= MAX_PAYLOAD_BYTES:
+        parser.error(f'--batch-max-bytes must be between 1 and {MAX_PAYLOAD_BYTES}')
+    if args.queue_capacity < 1:
+        parser.error('--queue-capacity must be at least 1')
+    if args.spool_segment_max_bytes < 1 or args.spool_max_bytes < args.spool_segment_max_bytes:
+        parser.error('--spool-max-bytes must be at least --spool-segment-max-bytes')
+    if args.max_inflight < 1:
+        parser.error('--max-inflight must be at least 1')
+    try:
+        can_codec.checkFormat(args.encoding, args.compression)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
     sleep(15)
-    
-    data = deque([])
+
+    spool = None
+    if args.overflow_policy == 'spill':
+        spool = Spool(args.spool_path, args.spool_segment_max_bytes, args.spool_max_bytes)
+    data = RecordQueue(args.queue_capacity, args.overflow_policy, spool, args.spool_threshold)
     print("starting")
-    threading.Thread(target=collectData, args=(data, args.serial_port)).start()  # Pass the serial port argument
-    threading.Thread(target=sendData, args=(data, )).start()
+    threading.Thread(target=collectData, args=(data, args.serial_port, args.validate)).start()  # Pass the serial port argument
+    threading.Thread(target=sendData, args=(data, args.batch_max_records, args.batch_max_bytes, args.batch_linger_ms,
+                                            args.max_inflight, args.max_retries, args.retry_backoff_ms,
+                                            args.stats_interval, args.encoding, args.compression)).start()
@@ -1,3 +1,4 @@
+#include <algorithm>
 #include <iostream>
 #include <cstdlib>
 #include <thread>
@@ -21,6 +22,10 @@ std::string thing_name;
 // global scope client publishing to IoT Core
 static GreengrassCoreIpcClient* mqttPub;
 
+// busiest CAN IDs of a channel forwarded to IoT Core, the full list of up to 2304 IDs can
+// exceed the 128 KB MQTT message size and stays in the local message
+static const size_t MAX_FORWARDED_IDS = 16;
+
 // maintain unique ID of device
 static std::string deviceId = "3-";
 static unsigned long messageNo = 0;
@@ -92,6 +97,81 @@ String produceJSON(std::string procStr) {
     return msg;
 }
 
+// copy of the latency stats of the versioned message, without the histogram buckets
+static JsonObject latencyStats(const JsonView &latency) {
+    JsonObject stats;
+    stats.WithInt64("Count", latency.GetInt64("count"));
+    if (latency.ValueExists("p50Us")) {
+        stats.WithInt64("P50Us", latency.GetInt64("p50Us"));
+        stats.WithInt64("P95Us", latency.GetInt64("p95Us"));
+        stats.WithInt64("P99Us", latency.GetInt64("p99Us"));
+        stats.WithInt64("MaxUs", latency.GetInt64("maxUs"));
+    }
+    return stats;
+}
+
+// produce the JSON from the versioned ipcf.proc JSON message, read field by field without any text parsing
+String produceJSONFromView(const JsonView &proc) {
+    std::time_t seconds = std::time(0);
+
+    JsonObject ipcStats;
+    ipcStats.WithInt64("BitsSent", proc.GetInt64("dataSizeBits"));
+    JsonObject mailboxStats;
+    mailboxStats.WithInt64("MailboxReadSuccessCount", proc.GetInt64("success"));
+    mailboxStats.WithInt64("MailboxReadErrorCount", proc.GetInt64("error"));
+
+    JsonObject stats;
+    stats.WithString("name", "GreengrassProcessing");
+    stats.WithString("id", String((deviceId + std::to_string(messageNo)).c_str()));
+    stats.WithString("ts_component", String(std::to_string(seconds).c_str()));
+    stats.WithString("ts_device", String(std::to_string(proc.GetInt64("preTs")).c_str()));
+    stats.WithObject("IPCProcessingStats", ipcStats);
+    stats.WithObject("MailboxProcessingStats", mailboxStats);
+
+    // fields only ever get added to a version, the ones this component does not know are ignored
+    if (proc.ValueExists("latency")) {
+        auto latency = proc.GetJsonObject("latency");
+        JsonObject latencyOut;
+        if (latency.ValueExists("frameToProc"))
+            latencyOut.WithObject("FrameToProc", latencyStats(latency.GetJsonObject("frameToProc")));
+        if (latency.ValueExists("procToAck"))
+            latencyOut.WithObject("ProcToAck", latencyStats(latency.GetJsonObject("procToAck")));
+        stats.WithObject("LatencyStats", latencyOut);
+    }
+    if (proc.ValueExists("channels")) {
+        Vector<JsonObject> channels;
+        for (auto &channel : proc.GetArray("channels")) {
+            JsonObject channelOut;
+            channelOut.WithString("Channel", channel.GetString("name"));
+            channelOut.WithInt64("BitsSent", channel.GetInt64("dataSizeBits"));
+            channelOut.WithInt64("SuccessCount", channel.GetInt64("success"));
+            channelOut.WithInt64("ErrorCount", channel.GetInt64("error"));
+            if (channel.ValueExists("ids")) {
+                auto all = channel.GetArray("ids");
+                std::vector<JsonView> busiest(all.begin(), all.end());
+                size_t forwarded = std::min(busiest.size(), MAX_FORWARDED_IDS);
+                std::partial_sort(busiest.begin(), busiest.begin() + forwarded, busiest.end(),
+                    [](const JsonView &a, const JsonView &b) { return a.GetInt64("frames") > b.GetInt64("frames"); });
+                Vector<JsonObject> ids;
+                for (size_t i = 0; i < forwarded; i++)
+                    ids.push_back(busiest[i].Materialize());
+                channelOut.WithInt64("IdCount", static_cast<int64_t>(all.size()));
+                channelOut.WithArray("Ids", std::move(ids));
+            }
+            channels.push_back(std::move(channelOut));
+        }
+        stats.WithArray("ChannelStats", std::move(channels));
+    }
+
+    return stats.View().WriteCompact();
+}
+
+// true for the versioned JSON message, false for the PROC text of older producers
+static bool isVersionedMessage(const JsonView &view) {
+    return view.IsObject() && view.ValueExists("schema") && view.GetString("schema") == "ipcf.proc"
+        && view.ValueExists("version") && view.GetInteger("version") >= 1;
+}
+
 // publishes messageStr to MQTT topic
 void publishMessage(String& messageStr) {
     
@@ -146,11 +226,18 @@ class SubscribeResponseHandler : public SubscribeToTopicStreamHandler {
             auto jsonMessage = response->GetJsonMessage();
             
             if (jsonMessage.has_value() && jsonMessage.value().GetMessage().has_value()) {
-                auto messageString = jsonMessage.value().GetMessage().value().View().WriteReadable();
-                std::string msg = std::string(messageString.begin(), messageString.end());
-                std::cout << "Received new message: " << msg << std::endl;
-                String msgString = produceJSON(msg);
-                publishMessage(msgString);
+                auto view = jsonMessage.value().GetMessage().value().View();
+                if (isVersionedMessage(view)) {
+                    std::cout << "Received new message version " << view.GetInteger("version") << std::endl;
+                    String msgString = produceJSONFromView(view);
+                    publishMessage(msgString);
+                } else {
+                    auto messageString = view.WriteReadable();
+                    std::string msg = std::string(messageString.begin(), messageString.end());
+                    std::cout << "Received new message: " << msg << std::endl;
+                    String msgString = produceJSON(msg);
+                    publishMessage(msgString);
+                }
             } else {
                 auto binaryMessage = response->GetBinaryMessage();
                 if (binaryMessage.has_value() && binaryMessage.value().GetMessage().has_value()) {
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Record CAN frames into a compact binary log, and replay logs onto a CAN bus.
+
+A log is a header followed by fixed size records, so it can be memory mapped and read
+without parsing:
+
+    header  b'CANLOG' | version u8 | data size u8     (8 bytes)
+    record  timestamp f64 | arbitration ID u32 | dlc u8 | length u8 | flags u8 | pad u8 | data
+
+The data of a record takes 8 bytes, or 64 in a log recorded with --fd. Timestamps are
+the ones of the frames, in seconds since the epoch.
+
+    python3 can_log.py record --channel can0 drive.canlog --duration 60
+    python3 can_log.py info drive.canlog
+    python3 can_log.py replay --channel vcan0 --speed 10 --loop --align drive.canlog other.canlog
+    python3 can_log.py replay --interface virtual --channel bench --speed max drive.canlog
+"""
+
+import argparse
+import heapq
+import mmap
+import struct
+import sys
+import time
+from collections import Counter
+
+import can
+
+MAGIC = b'CANLOG'
+VERSION = 1
+HEADER = struct.Struct('<6sBB')
+RECORD = struct.Struct('<dIBBBx')
+CAN_DATA = 8
+CANFD_DATA = 64
+
+FLAG_EXTENDED = 0x01
+FLAG_ERROR = 0x02
+FLAG_REMOTE = 0x04
+FLAG_FD = 0x08
+FLAG_BRS = 0x10
+FLAG_ESI = 0x20
+
+SPEED_MAX = 'max'
+
+
+class LogWriter:
+
+    def __init__(self, path, fd=False):
+        self.dataSize = CANFD_DATA if fd else CAN_DATA
+        self.record = struct.Struct(RECORD.format + f'{self.dataSize}s')
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.dataSize))
+        self.frames = 0
+
+    def write(self, msg):
+        if len(msg.data) > self.dataSize:
+            raise ValueError(f"{len(msg.data)} bytes frame in a log of {self.dataSize} bytes frames, record with --fd")
+        flags = ((FLAG_EXTENDED if msg.is_extended_id else 0) | (FLAG_ERROR if msg.is_error_frame else 0)
+                 | (FLAG_REMOTE if msg.is_remote_frame else 0) | (FLAG_FD if msg.is_fd else 0)
+                 | (FLAG_BRS if msg.bitrate_switch else 0) | (FLAG_ESI if msg.error_state_indicator else 0))
+        self.file.write(self.record.pack(msg.timestamp, msg.arbitration_id, msg.dlc, len(msg.data), flags,
+                                         bytes(msg.data)))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+class LogReader:
+    """Memory mapped log, iterating over its frames as (timestamp, can.Message)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if f.seek(0, 2) else b''
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path}: not a CAN log")
+        magic, version, self.dataSize = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} CAN log")
+        self.record = struct.Struct(RECORD.format + f'{self.dataSize}s')
+        # a record cut short by an interrupted recording is ignored
+        self.frames = (len(self.map) - HEADER.size) // self.record.size
+
+    def timestamp(self, index):
+        return struct.unpack_from('<d', self.map, HEADER.size + index * self.record.size)[0]
+
+    def __len__(self):
+        return self.frames
+
+    def __iter__(self):
+        end = HEADER.size + self.frames * self.record.size
+        for timestamp, arbitrationId, dlc, length, flags, data in self.record.iter_unpack(
+                memoryview(self.map)[HEADER.size:end]):
+            yield timestamp, can.Message(
+                timestamp=timestamp, arbitration_id=arbitrationId, dlc=dlc, data=data[:length],
+                is_extended_id=bool(flags & FLAG_EXTENDED), is_error_frame=bool(flags & FLAG_ERROR),
+                is_remote_frame=bool(flags & FLAG_REMOTE), is_fd=bool(flags & FLAG_FD),
+                bitrate_switch=bool(flags & FLAG_BRS), error_state_indicator=bool(flags & FLAG_ESI),
+                check=False)
+
+
+def openBus(args):
+    return can.Bus(interface=args.interface, channel=args.channel, fd=getattr(args, 'fd', False))
+
+
+def record(args):
+    bus = openBus(args)
+    writer = LogWriter(args.log, fd=args.fd)
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while (deadline is None or time.monotonic() < deadline) and (not args.frames or writer.frames < args.frames):
+            msg = bus.recv(timeout=0.5)
+            if msg is not None:
+                writer.write(msg)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        bus.shutdown()
+    print(f"recorded {writer.frames} frames to {args.log}")
+
+
+def info(args):
+    for path in args.logs:
+        reader = LogReader(path)
+        ids = Counter()
+        for _, msg in reader:
+            ids[(msg.arbitration_id, msg.is_extended_id)] += 1
+        duration = reader.timestamp(len(reader) - 1) - reader.timestamp(0) if len(reader) else 0.0
+        print(f"{path}: {len(reader)} frames of up to {reader.dataSize} bytes, {duration:.3f}s,"
+              f" {len(ids)} IDs, {len(reader) / duration if duration else 0:,.0f} frames/s")
+        for (arbitrationId, extended), count in ids.most_common(args.top):
+            print(f"  {arbitrationId:08X}" if extended else f"  {arbitrationId:03X}     ", count)
+
+
+def shifted(reader, shift):
+    for timestamp, msg in reader:
+        yield timestamp + shift, msg
+
+
+def passes(readers, loop, align=False):
+    # the frames of all the logs in timestamp order, with align each log shifted to start with
+    # the first one, then again after the end of the previous pass when looping
+    first = min(reader.timestamp(0) for reader in readers)
+    shifts = [first - reader.timestamp(0) if align else 0.0 for reader in readers]
+    duration = max(reader.timestamp(len(reader) - 1) + shift for reader, shift in zip(readers, shifts)) - first
+    # as much time between two passes as between two frames on average
+    period = duration + duration / max(sum(len(reader) for reader in readers), 1)
+    offset = 0.0
+    while True:
+        streams = [shifted(reader, shift + offset) for reader, shift in zip(readers, shifts)]
+        yield from heapq.merge(*streams, key=lambda frame: frame[0])
+        if not loop:
+            return
+        offset += period
+
+
+def send(bus, msg):
+    while True:
+        try:
+            bus.send(msg)
+            return
+        except can.CanOperationError:
+            # the socket buffer is full, the interface drains it at the bus speed
+            time.sleep(0.0005)
+
+
+def replay(args):
+    readers = [reader for reader in (LogReader(path) for path in args.logs) if len(reader)]
+    if not readers:
+        print("nothing to replay")
+        return
+    speed = None if args.speed == SPEED_MAX else float(args.speed)
+    bus = openBus(args)
+    sent = 0
+    start = time.monotonic()
+    origin = None
+    try:
+        for timestamp, msg in passes(readers, args.loop, args.align):
+            if origin is None:
+                origin = timestamp
+            if speed is not None:
+                delay = (timestamp - origin) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if args.retimestamp:
+                msg.timestamp = time.time()
+            send(bus, msg)
+            sent += 1
+            if args.frames and sent >= args.frames:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.shutdown()
+    elapsed = time.monotonic() - start
+    print(f"replayed {sent} frames in {elapsed:.3f}s ({sent / elapsed if elapsed else 0:,.0f} frames/s)")
+
+
+def speedArg(value):
+    if value == SPEED_MAX:
+        return value
+    if float(value) <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or max")
+    return value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recordParser = commands.add_parser('record', help='Record the frames of a bus')
+    recordParser.add_argument('log', help='Log file written')
+    recordParser.add_argument('--fd', action='store_true', help='Record CAN FD frames, 64 bytes of data per record')
+    recordParser.add_argument('--duration', type=float, default=0, help='Seconds to record, until Ctrl-C by default')
+    recordParser.add_argument('--frames', type=int, default=0, help='Number of frames to record, unlimited by default')
+    recordParser.set_defaults(run=record)
+
+    infoParser = commands.add_parser('info', help='Describe logs')
+    infoParser.add_argument('logs', nargs='+')
+    infoParser.add_argument('--top', type=int, default=10, help='Number of most frequent IDs listed')
+    infoParser.set_defaults(run=info)
+
+    replayParser = commands.add_parser('replay', help='Send the frames of logs, merged in timestamp order')
+    replayParser.add_argument('logs', nargs='+')
+    replayParser.add_argument('--speed', type=speedArg, default='1',
+                              help='Replay speed, 1 for real time, N for N times faster, max to send as fast as possible')
+    replayParser.add_argument('--loop', action='store_true', help='Replay the logs again and again')
+    replayParser.add_argument('--align', action='store_true',
+                              help='Start all the logs together, instead of keeping the times they were recorded at')
+    replayParser.add_argument('--frames', type=int, default=0, help='Stop after this many frames')
+    replayParser.add_argument('--retimestamp', action='store_true',
+                              help='Timestamp the frames when sent, for interfaces that keep the sender timestamp')
+    replayParser.add_argument('--fd', action='store_true', help='Open the bus in CAN FD mode')
+    replayParser.set_defaults(run=replay)
+
+    for commandParser in (recordParser, replayParser):
+        commandParser.add_argument('--interface', default='socketcan', help='python-can interface')
+        commandParser.add_argument('--channel', default='vcan0', help='CAN channel')
+
+    args = parser.parse_args()
+    sys.exit(args.run(args))
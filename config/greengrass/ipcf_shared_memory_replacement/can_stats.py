@@ -0,0 +1,388 @@
+"""Per arbitration ID CAN statistics, kept in preallocated arrays so counting a frame allocates nothing.
+
+Standard 11-bit IDs index the table directly, extended 29-bit IDs are given one of a fixed
+number of extra slots the first time they are seen. Frames of extended IDs arriving once all
+the slots are taken are only counted in the totals.
+
+DoubleBufferedStats lets one ingestion thread count frames without ever taking a lock while
+another thread swaps the aggregation windows, without losing a frame.
+
+Every window also keeps a histogram of the latency from the frame timestamp to its processing,
+and when its frames were processed, to measure the latency up to the publish ack.
+
+With a SignalDecoder, the windows also keep the statistics of the signals decoded from the
+frames, see dbc_decoder.py.
+
+IDs can be sampled: only every Nth frame of the ID is looked at, and counted N times. The
+totals always count every frame.
+
+Batches of frames are counted with NumPy, operating in place on the same arrays, when it is
+installed, and frame by frame otherwise.
+"""
+
+import time
+from array import array
+
+from dbc_decoder import SignalStats
+from histogram import LatencyHistogram
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STANDARD_IDS = 2048
+EXTENDED_SLOTS = 256
+# DLC codes 0-15, 9-15 only appear on CAN FD
+DLC_CODES = 16
+
+CAN_EFF_FLAG = 0x80000000
+
+# the processing times of a window are kept with a resolution of window / PROCESSED_BINS
+PROCESSED_BINS = 1000
+
+
+def zeros(typecode, size):
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class CanStatsTable:
+    """Statistics of one aggregation window.
+
+    Inter-arrival times are computed against the last frame of the same ID, which is kept
+    across windows by reset(). The jitter of a frame is the absolute difference between its
+    inter-arrival time and the previous one. Times are in seconds.
+    """
+
+    def __init__(self, extendedSlots=EXTENDED_SLOTS, shared=None, sampling=None, window=10.0, decoder=None):
+        self.slots = STANDARD_IDS + extendedSlots
+        self.signals = SignalStats(decoder) if decoder is not None else None
+        self.frameLatency = LatencyHistogram()
+        self.processedAt = zeros('Q', PROCESSED_BINS)
+        self.processedResolution = float(window) / PROCESSED_BINS
+        self.activatedAt = time.time()
+        if shared is not None:
+            # the windows of a DoubleBufferedStats share the slot assignment, the arrival times and the sampling
+            self.extendedIds = shared.extendedIds
+            self.slotIds = shared.slotIds
+            self.lastTimestamp = shared.lastTimestamp
+            self.lastGap = shared.lastGap
+            self.sampling = shared.sampling
+            self.sampleRate = shared.sampleRate
+            self.sampleCount = shared.sampleCount
+        else:
+            self.extendedIds = {}
+            self.slotIds = array('L', range(STANDARD_IDS)) + zeros('L', extendedSlots)
+            self.lastTimestamp = zeros('d', self.slots)
+            self.lastGap = zeros('d', self.slots)
+            # sampling rate keyed by arbitration ID, CAN_EFF_FLAG set for extended IDs
+            self.sampling = dict(sampling or {})
+            self.sampleRate = array('Q', [1]) * self.slots
+            self.sampleCount = zeros('Q', self.slots)
+            for arbitrationId, rate in self.sampling.items():
+                if rate < 1:
+                    raise ValueError(f"Sampling rate of {formatId(arbitrationId)} must be at least 1")
+                if not arbitrationId & CAN_EFF_FLAG and arbitrationId < STANDARD_IDS:
+                    self.sampleRate[arbitrationId] = rate
+        self.frames = zeros('Q', self.slots)
+        self.bytes = zeros('Q', self.slots)
+        self.errorFrames = zeros('Q', self.slots)
+        self.gapCount = zeros('Q', self.slots)
+        self.gapSum = zeros('d', self.slots)
+        self.gapMin = zeros('d', self.slots)
+        self.gapMax = zeros('d', self.slots)
+        self.jitterCount = zeros('Q', self.slots)
+        self.jitterSum = zeros('d', self.slots)
+        self.jitterMin = zeros('d', self.slots)
+        self.jitterMax = zeros('d', self.slots)
+        self.dlc = zeros('Q', self.slots * DLC_CODES)
+        self.views = None
+        self.reset()
+
+    def reset(self):
+        """Start a new window, the per ID arrival times are kept."""
+        for counters in (self.frames, self.bytes, self.errorFrames, self.gapCount, self.gapSum, self.gapMax,
+                         self.jitterCount, self.jitterSum, self.jitterMax, self.dlc):
+            counters[:] = zeros(counters.typecode, len(counters))
+        self.frameLatency.reset()
+        self.processedAt[:] = zeros('Q', PROCESSED_BINS)
+        if self.signals is not None:
+            self.signals.reset()
+        self.gapMin[:] = array('d', [float('inf')]) * self.slots
+        self.jitterMin[:] = array('d', [float('inf')]) * self.slots
+        self.totalFrames = 0
+        self.totalBytes = 0
+        self.totalErrorFrames = 0
+        self.untrackedFrames = 0
+
+    def slot(self, arbitrationId, isExtended):
+        if not isExtended and arbitrationId < STANDARD_IDS:
+            return arbitrationId
+        slot = self.extendedIds.get(arbitrationId)
+        if slot is None:
+            if len(self.extendedIds) >= self.slots - STANDARD_IDS:
+                return -1
+            slot = STANDARD_IDS + len(self.extendedIds)
+            self.extendedIds[arbitrationId] = slot
+            self.slotIds[slot] = arbitrationId | CAN_EFF_FLAG
+            self.sampleRate[slot] = self.sampling.get(arbitrationId | CAN_EFF_FLAG, 1)
+        return slot
+
+    def add(self, arbitrationId, isExtended, dlc, size, timestamp, isError=False):
+        self.totalFrames += 1
+        self.totalBytes += size
+        if isError:
+            self.totalErrorFrames += 1
+        slot = self.slot(arbitrationId, isExtended)
+        if slot < 0:
+            self.untrackedFrames += 1
+            return
+        rate = self.sampleRate[slot]
+        if rate != 1:
+            self.sampleCount[slot] += 1
+            if self.sampleCount[slot] % rate:
+                return
+        self.frames[slot] += rate
+        self.bytes[slot] += size * rate
+        if isError:
+            self.errorFrames[slot] += rate
+        self.dlc[slot * DLC_CODES + (dlc & 0xF)] += rate
+        last = self.lastTimestamp[slot]
+        self.lastTimestamp[slot] = timestamp
+        if last == 0.0:
+            return
+        # the time between two sampled frames spans rate frames
+        gap = (timestamp - last) / rate
+        self.gapCount[slot] += 1
+        self.gapSum[slot] += gap
+        if gap < self.gapMin[slot]:
+            self.gapMin[slot] = gap
+        if gap > self.gapMax[slot]:
+            self.gapMax[slot] = gap
+        previous = self.lastGap[slot]
+        self.lastGap[slot] = gap
+        if previous == 0.0:
+            return
+        jitter = gap - previous if gap > previous else previous - gap
+        self.jitterCount[slot] += 1
+        self.jitterSum[slot] += jitter
+        if jitter < self.jitterMin[slot]:
+            self.jitterMin[slot] = jitter
+        if jitter > self.jitterMax[slot]:
+            self.jitterMax[slot] = jitter
+
+    def addMessage(self, msg, now=None):
+        """Count a python-can Message processed at now, time.time() by default."""
+        if now is None:
+            now = time.time()
+        if msg.timestamp:
+            self.frameLatency.record((now - msg.timestamp) * 1e6)
+        self.processed(now)
+        if self.signals is not None:
+            self.signals.addMessage(msg)
+        self.add(msg.arbitration_id, msg.is_extended_id, msg.dlc, len(msg.data), msg.timestamp, msg.is_error_frame)
+
+    def addMessages(self, msgs, now=None):
+        """Count a batch of python-can Messages, received in that order."""
+        if np is None or len(msgs) < 2:
+            if now is None:
+                now = time.time()
+            for msg in msgs:
+                self.addMessage(msg, now)
+            return
+        if now is None:
+            now = time.time()
+        count = len(msgs)
+        timestamps = np.fromiter((m.timestamp for m in msgs), dtype=np.float64, count=count)
+        self.frameLatency.recordMany((now - timestamps[timestamps != 0.0]) * 1e6)
+        self.processed(now, count)
+        ids = np.fromiter((m.arbitration_id for m in msgs), dtype=np.int64, count=count)
+        extended = np.fromiter((m.is_extended_id for m in msgs), dtype=bool, count=count)
+        if self.signals is not None:
+            self.signals.addMessages(msgs, ids, extended)
+        self.addBatch(
+            ids,
+            extended,
+            np.fromiter((m.dlc for m in msgs), dtype=np.int64, count=count),
+            np.fromiter((len(m.data) for m in msgs), dtype=np.int64, count=count),
+            timestamps,
+            np.fromiter((m.is_error_frame for m in msgs), dtype=bool, count=count),
+        )
+
+    def processed(self, now, count=1):
+        index = int((now - self.activatedAt) / self.processedResolution)
+        self.processedAt[min(max(index, 0), PROCESSED_BINS - 1)] += count
+
+    def recordAckLatency(self, ackTime, histogram):
+        """Record in histogram the latency from the processing of every frame of the window to ackTime."""
+        for index, count in enumerate(self.processedAt):
+            if count:
+                processedAt = self.activatedAt + (index + 0.5) * self.processedResolution
+                histogram.record((ackTime - processedAt) * 1e6, count)
+
+    def addBatch(self, ids, extended, dlcs, sizes, timestamps, errors):
+        """Count a batch of frames given as NumPy arrays, equivalent to calling add() on each frame in order."""
+        v = self.arrays()
+        self.totalFrames += len(ids)
+        self.totalBytes += int(sizes.sum())
+        self.totalErrorFrames += int(errors.sum())
+
+        slots = np.where(~extended & (ids < STANDARD_IDS), ids, -1)
+        unmapped = slots < 0
+        if unmapped.any():
+            # in order of first appearance, slots are given out like add() would
+            keys = dict.fromkeys(zip(ids[unmapped].tolist(), extended[unmapped].tolist()))
+            for arbitrationId, isExtended in keys:
+                mask = unmapped & (ids == arbitrationId) & (extended == isExtended)
+                slots[mask] = self.slot(arbitrationId, isExtended)
+        tracked = slots >= 0
+        self.untrackedFrames += int((~tracked).sum())
+        slots, dlcs, sizes, timestamps, errors = (
+            slots[tracked], dlcs[tracked], sizes[tracked], timestamps[tracked], errors[tracked])
+        if not len(slots):
+            return
+
+        # group the frames by ID, keeping their order within an ID
+        order = np.argsort(slots, kind='stable')
+        slots, dlcs, sizes, timestamps, errors = (
+            slots[order], dlcs[order], sizes[order], timestamps[order], errors[order])
+        first = np.ones(len(slots), dtype=bool)
+        first[1:] = slots[1:] != slots[:-1]
+
+        rates = v['sampleRate'][slots]
+        sampled = rates != 1
+        if sampled.any():
+            # number each frame within its ID, continuing from the previous batches
+            starts = np.flatnonzero(first)
+            rank = np.arange(len(slots)) - np.repeat(starts, np.diff(np.append(starts, len(slots))))
+            keep = ~sampled | ((v['sampleCount'][slots] + rank.astype(np.uint64) + 1) % rates == 0)
+            np.add.at(v['sampleCount'], slots[sampled], 1)
+            slots, dlcs, sizes, timestamps, errors, rates = (
+                slots[keep], dlcs[keep], sizes[keep], timestamps[keep], errors[keep], rates[keep])
+            if not len(slots):
+                return
+            first = np.ones(len(slots), dtype=bool)
+            first[1:] = slots[1:] != slots[:-1]
+        last = np.ones(len(slots), dtype=bool)
+        last[:-1] = first[1:]
+
+        np.add.at(v['frames'], slots, rates)
+        np.add.at(v['bytes'], slots, sizes.astype(np.uint64) * rates)
+        np.add.at(v['errorFrames'], slots, errors.astype(np.uint64) * rates)
+        np.add.at(v['dlc'], slots * DLC_CODES + (dlcs & 0xF), rates)
+
+        previous = np.empty_like(timestamps)
+        previous[1:] = timestamps[:-1]
+        previous[first] = v['lastTimestamp'][slots[first]]
+        v['lastTimestamp'][slots[last]] = timestamps[last]
+        hasGap = previous != 0.0
+        gaps = np.where(hasGap, (timestamps - previous) / rates, 0.0)
+
+        previousGaps = np.empty_like(gaps)
+        previousGaps[1:] = gaps[:-1]
+        previousGaps[first] = v['lastGap'][slots[first]]
+        updateGap = last & hasGap
+        v['lastGap'][slots[updateGap]] = gaps[updateGap]
+
+        gapSlots = slots[hasGap]
+        gaps = gaps[hasGap]
+        np.add.at(v['gapCount'], gapSlots, 1)
+        np.add.at(v['gapSum'], gapSlots, gaps)
+        np.minimum.at(v['gapMin'], gapSlots, gaps)
+        np.maximum.at(v['gapMax'], gapSlots, gaps)
+
+        hasJitter = previousGaps[hasGap] != 0.0
+        jitterSlots = gapSlots[hasJitter]
+        jitters = np.abs(gaps[hasJitter] - previousGaps[hasGap][hasJitter])
+        np.add.at(v['jitterCount'], jitterSlots, 1)
+        np.add.at(v['jitterSum'], jitterSlots, jitters)
+        np.minimum.at(v['jitterMin'], jitterSlots, jitters)
+        np.maximum.at(v['jitterMax'], jitterSlots, jitters)
+
+    def arrays(self):
+        # NumPy views sharing the memory of the counters, created once
+        if self.views is None:
+            self.views = {
+                name: np.frombuffer(getattr(self, name), dtype=np.uint64 if getattr(self, name).typecode == 'Q'
+                                    else np.float64)
+                for name in ('lastTimestamp', 'lastGap', 'sampleRate', 'sampleCount', 'frames', 'bytes', 'errorFrames', 'gapCount', 'gapSum',
+                             'gapMin', 'gapMax', 'jitterCount', 'jitterSum', 'jitterMin', 'jitterMax', 'dlc')
+            }
+        return self.views
+
+    def idStats(self):
+        """Return the statistics of every ID seen in the window, keyed by arbitration ID."""
+        stats = {}
+        for slot in range(self.slots):
+            frames = self.frames[slot]
+            if not frames:
+                continue
+            gaps = self.gapCount[slot]
+            jitters = self.jitterCount[slot]
+            base = slot * DLC_CODES
+            stats[self.slotIds[slot]] = {
+                'frames': frames,
+                'bytes': self.bytes[slot],
+                'errorFrames': self.errorFrames[slot],
+                'gapMin': self.gapMin[slot] if gaps else None,
+                'gapMax': self.gapMax[slot] if gaps else None,
+                'gapMean': self.gapSum[slot] / gaps if gaps else None,
+                'jitterMin': self.jitterMin[slot] if jitters else None,
+                'jitterMax': self.jitterMax[slot] if jitters else None,
+                'jitterMean': self.jitterSum[slot] / jitters if jitters else None,
+                'dlc': {code: count for code, count in enumerate(self.dlc[base:base + DLC_CODES]) if count},
+            }
+        return stats
+
+
+class DoubleBufferedStats:
+    """Two CanStatsTable windows, one written by a single ingestion thread while the other is read.
+
+    The writer only flags that it is counting a frame and bumps a sequence number, it never
+    locks. swap() makes the idle window the active one, then waits for the frame the writer
+    may have been counting in the retired window, if any, to complete. CPython executes these
+    attribute loads and stores in program order, so once swap() returns the retired window is
+    not written anymore and every frame was counted in exactly one window.
+    """
+
+    def __init__(self, extendedSlots=EXTENDED_SLOTS, sampling=None, window=10.0, decoder=None):
+        self.active = CanStatsTable(extendedSlots, sampling=sampling, window=window, decoder=decoder)
+        self.idle = CanStatsTable(extendedSlots, shared=self.active, window=window, decoder=decoder)
+        self.busy = False
+        self.sequence = 0
+
+    def add(self, arbitrationId, isExtended, dlc, size, timestamp, isError=False):
+        self.busy = True
+        self.active.add(arbitrationId, isExtended, dlc, size, timestamp, isError)
+        self.sequence += 1
+        self.busy = False
+
+    def addMessage(self, msg):
+        self.busy = True
+        self.active.addMessage(msg)
+        self.sequence += 1
+        self.busy = False
+
+    def addMessages(self, msgs):
+        self.busy = True
+        self.active.addMessages(msgs)
+        self.sequence += 1
+        self.busy = False
+
+    def swap(self):
+        """Start a new window and return the completed one, to be reset() once read."""
+        retired = self.active
+        self.idle.activatedAt = time.time()
+        self.active = self.idle
+        self.idle = retired
+        sequence = self.sequence
+        while self.busy and self.sequence == sequence:
+            time.sleep(0)
+        return retired
+
+
+def formatId(arbitrationId):
+    # extended IDs are printed with 8 hex digits like candump does
+    if arbitrationId & CAN_EFF_FLAG:
+        return f"{arbitrationId & ~CAN_EFF_FLAG:08X}"
+    return f"{arbitrationId:03X}"
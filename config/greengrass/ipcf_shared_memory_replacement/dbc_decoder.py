@@ -0,0 +1,218 @@
+"""Decode the signals of CAN frames with a DBC file, and keep per signal statistics.
+
+Only the message (BO_) and signal (SG_) definitions of the DBC are read. Every signal is
+compiled once into an extraction plan: the frame data, zero padded to the message size
+and at least 8 bytes, is read as one big endian integer for Motorola (@0) signals or one
+little endian integer for Intel (@1) signals, from which the raw value is a shift and a
+mask away, then scaled and offset. Messages of up to 8 bytes are decoded for a whole batch
+of frames at once with NumPy when it is installed, longer CAN FD messages frame by frame.
+
+Multiplexed and floating point signals are not supported and are skipped.
+"""
+
+import re
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# bit 31 of a DBC message ID flags an extended ID
+DBC_EXTENDED_FLAG = 0x80000000
+
+MESSAGE_RE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)')
+SIGNAL_RE = re.compile(
+    r'^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*'
+    r'\(\s*([^,\s]+)\s*,\s*([^)\s]+)\s*\)\s*\[([^|]*)\|([^\]]*)\]\s*"([^"]*)"')
+
+Message = namedtuple('Message', ['arbitrationId', 'isExtended', 'name', 'size', 'signals'])
+Signal = namedtuple('Signal', ['name', 'startBit', 'length', 'littleEndian', 'signed', 'scale', 'offset', 'unit'])
+# width in bytes of the integer the frame data is read as, shift and mask of the raw value in it
+Plan = namedtuple('Plan', ['index', 'signal', 'width', 'shift', 'mask'])
+
+
+def parseDbc(text):
+    """Return the messages of a DBC file, and the names of the signals that were skipped."""
+    messages = []
+    skipped = []
+    message = None
+    for line in text.splitlines():
+        line = line.strip()
+        match = MESSAGE_RE.match(line)
+        if match:
+            dbcId, name, size, _ = match.groups()
+            dbcId = int(dbcId)
+            message = Message(dbcId & ~DBC_EXTENDED_FLAG, bool(dbcId & DBC_EXTENDED_FLAG), name, int(size), [])
+            messages.append(message)
+            continue
+        if not line.startswith('SG_ '):
+            if line:
+                message = None
+            continue
+        match = SIGNAL_RE.match(line)
+        if message is None or match is None:
+            skipped.append(line.split()[1] if len(line.split()) > 1 else line)
+            continue
+        name, multiplexing, startBit, length, byteOrder, sign, scale, offset, _, _, unit = match.groups()
+        if multiplexing:
+            skipped.append(name)
+            continue
+        message.signals.append(Signal(name, int(startBit), int(length), byteOrder == '1', sign == '-',
+                                      float(scale), float(offset), unit))
+    return [message for message in messages if message.signals], skipped
+
+
+def compilePlan(index, signal, size):
+    width = max(size, 8)
+    if signal.littleEndian:
+        shift = signal.startBit
+    else:
+        # Motorola start bits number the bits of each byte from its LSB, and give the MSB of the signal
+        msb = (width - 1 - signal.startBit // 8) * 8 + signal.startBit % 8
+        shift = msb - signal.length + 1
+    if shift < 0 or shift + signal.length > width * 8:
+        raise ValueError(f"Signal {signal.name} does not fit in {size} bytes")
+    return Plan(index, signal, width, shift, (1 << signal.length) - 1)
+
+
+class SignalDecoder:
+    """Extraction plans of all the signals of a DBC, shared by the windows counting their statistics."""
+
+    def __init__(self, text):
+        self.messages, self.skipped = parseDbc(text)
+        self.signals = []
+        # plans by (arbitration ID, extended)
+        self.plans = {}
+        for message in self.messages:
+            plans = []
+            for signal in message.signals:
+                plans.append(compilePlan(len(self.signals), signal, message.size))
+                self.signals.append((message, signal))
+            self.plans[(message.arbitrationId, message.isExtended)] = (message, plans)
+
+    @classmethod
+    def fromFile(cls, path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return cls(f.read())
+
+
+def signExtend(raw, length):
+    if raw & (1 << (length - 1)):
+        return raw - (1 << length)
+    return raw
+
+
+class SignalStats:
+    """Min, max, mean and last value of every signal of a decoder in one aggregation window."""
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        count = len(decoder.signals)
+        self.count = array('Q', bytes(8 * count))
+        self.sum = array('d', bytes(8 * count))
+        self.min = array('d', bytes(8 * count))
+        self.max = array('d', bytes(8 * count))
+        self.last = array('d', bytes(8 * count))
+        self.reset()
+
+    def reset(self):
+        count = len(self.decoder.signals)
+        self.count[:] = array('Q', bytes(8 * count))
+        self.sum[:] = array('d', bytes(8 * count))
+        self.min[:] = array('d', [float('inf')]) * count
+        self.max[:] = array('d', [float('-inf')]) * count
+        # frames of a decoded message shorter than the message
+        self.shortFrames = 0
+
+    def record(self, index, value):
+        self.count[index] += 1
+        self.sum[index] += value
+        if value < self.min[index]:
+            self.min[index] = value
+        if value > self.max[index]:
+            self.max[index] = value
+        self.last[index] = value
+
+    def addMessage(self, msg):
+        entry = self.decoder.plans.get((msg.arbitration_id, msg.is_extended_id))
+        if entry is None:
+            return
+        message, plans = entry
+        if len(msg.data) < message.size:
+            self.shortFrames += 1
+            return
+        data = bytes(msg.data[:message.size])
+        data += bytes(plans[0].width - len(data))
+        bigEndian = int.from_bytes(data, 'big')
+        littleEndian = int.from_bytes(data, 'little')
+        for plan in plans:
+            signal = plan.signal
+            raw = ((littleEndian if signal.littleEndian else bigEndian) >> plan.shift) & plan.mask
+            if signal.signed:
+                raw = signExtend(raw, signal.length)
+            self.record(plan.index, raw * signal.scale + signal.offset)
+
+    def addMessages(self, msgs, ids=None, extended=None):
+        """Decode a batch of frames, ids and extended are NumPy arrays of their IDs when already built."""
+        if np is None or len(msgs) < 2:
+            for msg in msgs:
+                self.addMessage(msg)
+            return
+        if ids is None:
+            ids = np.fromiter((m.arbitration_id for m in msgs), dtype=np.int64, count=len(msgs))
+            extended = np.fromiter((m.is_extended_id for m in msgs), dtype=bool, count=len(msgs))
+        for (arbitrationId, isExtended), (message, plans) in self.decoder.plans.items():
+            indexes = np.flatnonzero((ids == arbitrationId) & (extended == isExtended))
+            if not len(indexes):
+                continue
+            if plans[0].width != 8:
+                for i in indexes:
+                    self.addMessage(msgs[i])
+                continue
+            datas = [msgs[i].data for i in indexes]
+            complete = [len(data) >= message.size for data in datas]
+            if not all(complete):
+                self.shortFrames += complete.count(False)
+                datas = [data for data, ok in zip(datas, complete) if ok]
+                if not datas:
+                    continue
+            buffer = b''.join(bytes(data[:message.size]).ljust(8, b'\0') for data in datas)
+            bigEndian = np.frombuffer(buffer, dtype='>u8')
+            littleEndian = np.frombuffer(buffer, dtype='<u8')
+            for plan in plans:
+                signal = plan.signal
+                raw = ((littleEndian if signal.littleEndian else bigEndian) >> np.uint64(plan.shift)) & np.uint64(plan.mask)
+                if signal.signed:
+                    values = raw.astype(np.int64)
+                    if signal.length < 64:
+                        values -= ((values >> (signal.length - 1)) & 1) << signal.length
+                    values = values.astype(np.float64)
+                else:
+                    values = raw.astype(np.float64)
+                values = values * signal.scale + signal.offset
+                index = plan.index
+                self.count[index] += len(values)
+                self.sum[index] += float(values.sum())
+                self.min[index] = min(self.min[index], float(values.min()))
+                self.max[index] = max(self.max[index], float(values.max()))
+                self.last[index] = float(values[-1])
+
+    def signalStats(self):
+        """Statistics of the signals decoded in the window, by signal name."""
+        stats = {}
+        for index, (message, signal) in enumerate(self.decoder.signals):
+            count = self.count[index]
+            if not count:
+                continue
+            stats[signal.name] = {
+                'message': message.name,
+                'unit': signal.unit,
+                'count': count,
+                'min': self.min[index],
+                'max': self.max[index],
+                'mean': self.sum[index] / count,
+                'last': self.last[index],
+            }
+        return stats
@@ -0,0 +1,116 @@
+"""Fixed memory latency histograms with log-linear buckets, in the style of HdrHistogram.
+
+Values are integers, microseconds here. Values below 2 * SUB_BUCKETS have a bucket each,
+above every power of two range is split into SUB_BUCKETS buckets, so a value is known to
+within 1 / SUB_BUCKETS of itself (6.25%). Every histogram has the same buckets, so
+histograms of different windows or devices are merged by adding their counts, including
+from their text form:
+
+    Hist 4 0:12,33:5,70:1
+
+that is the number of sub-bucket bits then the non-empty buckets as index:count.
+"""
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# values up to 2^40 us, about 12 days, larger ones are counted in the last bucket
+MAX_BITS = 40
+BUCKETS = (MAX_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+MAX_VALUE = (1 << MAX_BITS) - 1
+
+
+def bucketIndex(value):
+    if value >= MAX_VALUE:
+        value = MAX_VALUE
+    elif value < 0:
+        value = 0
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift < 0:
+        return value
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def bucketHighest(index):
+    """Highest value counted in the bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return ((index - (shift << SUB_BUCKET_BITS) + 1) << shift) - 1
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKETS))
+        self.view = None
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = array('Q', bytes(8 * BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    def record(self, value, count=1):
+        value = int(value)
+        self.counts[bucketIndex(value)] += count
+        self.count += count
+        if value > self.max:
+            self.max = value
+
+    def recordMany(self, values):
+        """Record a NumPy array of values."""
+        if not len(values):
+            return
+        values = np.clip(values, 0, MAX_VALUE).astype(np.int64)
+        # frexp gives the bit length of the integer values as exponent
+        shift = np.maximum(np.frexp(values.astype(np.float64))[1] - SUB_BUCKET_BITS - 1, 0)
+        indexes = np.where(values < 2 * SUB_BUCKETS, values, (shift << SUB_BUCKET_BITS) + (values >> shift))
+        if self.view is None:
+            self.view = np.frombuffer(self.counts, dtype=np.uint64)
+        self.view += np.bincount(indexes, minlength=BUCKETS).astype(np.uint64)
+        self.count += len(values)
+        self.max = max(self.max, int(values.max()))
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Highest value of the bucket holding the given percentile, capped to the maximum recorded."""
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucketHighest(index), self.max)
+        return self.max
+
+    def format(self):
+        buckets = ",".join(f"{index}:{count}" for index, count in enumerate(self.counts) if count)
+        return f"Hist {SUB_BUCKET_BITS} {buckets}"
+
+    @classmethod
+    def parse(cls, text):
+        """Histogram from the output of format(), its max is the highest value of its last bucket."""
+        words = text.split()
+        if words[:2] != ["Hist", str(SUB_BUCKET_BITS)]:
+            raise ValueError(f"Not a histogram with {SUB_BUCKET_BITS} sub-bucket bits: {text[:40]}")
+        histogram = cls()
+        for item in words[2].split(',') if len(words) > 2 else ():
+            index, count = (int(x) for x in item.split(':'))
+            histogram.counts[index] += count
+            histogram.count += count
+            histogram.max = max(histogram.max, bucketHighest(index))
+        return histogram
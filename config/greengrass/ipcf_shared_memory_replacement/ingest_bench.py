@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmark of the two ingestion modes of the component on a python-can virtual bus.
+
+The frames are queued on the virtual bus first, like a saturated socket buffer, then
+counted either by a can.Notifier calling the per frame listener, or by the batch loop
+draining the bus and counting each batch at once. Reports frames/s and the CPU time used
+per frame by the whole process.
+
+    python3 ingest_bench.py --frames 500000 --max-batch 1024
+"""
+
+import argparse
+import threading
+import time
+
+import can
+
+import can_stats
+from can_stats import DoubleBufferedStats
+from ipcf_shared_memory_replacement import ingestBatches
+
+
+def makeMessages(ids, fd):
+    messages = []
+    size = 64 if fd else 8
+    timestamp = time.time()
+    for i in range(ids):
+        messages.append(can.Message(arbitration_id=0x100 + i, is_extended_id=False, data=bytes(size), is_fd=fd,
+                                    timestamp=timestamp))
+        messages.append(can.Message(arbitration_id=0x18DA0000 + i, is_extended_id=True, data=bytes(size), is_fd=fd,
+                                    timestamp=timestamp))
+    return messages
+
+
+def fill(sender, receiver, messages, frames):
+    for i in range(frames):
+        sender.send(messages[i % len(messages)])
+    while receiver.queue.qsize() < frames:
+        time.sleep(0.01)
+
+
+def runNotifier(receiver, stats, frames):
+    notifier = can.Notifier(receiver, [stats.addMessage], timeout=0.01)
+    while stats.active.totalFrames < frames:
+        time.sleep(0.001)
+    notifier.stop()
+
+
+def runBatch(receiver, stats, frames, maxBatch):
+    # ingestBatches of the component, stopped once everything was counted
+    stop = threading.Event()
+    worker = threading.Thread(target=ingestBatches, args=(receiver, stats, maxBatch, 0.01, stop))
+    worker.start()
+    while stats.active.totalFrames < frames:
+        time.sleep(0.001)
+    stop.set()
+    worker.join()
+
+
+def measure(mode, args, messages):
+    channel = f'ipcf-bench-{mode}'
+    receiver = can.Bus(interface='virtual', channel=channel, receive_own_messages=False)
+    sender = can.Bus(interface='virtual', channel=channel)
+    fill(sender, receiver, messages, args.frames)
+    stats = DoubleBufferedStats()
+
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    if mode == 'notifier':
+        runNotifier(receiver, stats, args.frames)
+    else:
+        runBatch(receiver, stats, args.frames, args.max_batch)
+    cpu = time.process_time() - cpuStart
+    elapsed = time.perf_counter() - start
+
+    sender.shutdown()
+    receiver.shutdown()
+    assert stats.active.totalFrames == args.frames, stats.active.totalFrames
+    print(f"{mode:9} {args.frames / elapsed:12,.0f} frames/s {cpu / args.frames * 1e6:8.2f} us CPU/frame")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=500000, help='Number of frames counted per mode')
+    parser.add_argument('--ids', type=int, default=64, help='Number of distinct standard IDs, plus as many extended ones')
+    parser.add_argument('--max-batch', type=int, default=1024, help='Maximum number of frames counted at once')
+    parser.add_argument('--fd', action='store_true', help='Send 64 byte CAN FD frames')
+    args = parser.parse_args()
+
+    print(f"numpy: {'yes' if can_stats.np is not None else 'no, batches are counted frame by frame'}")
+    messages = makeMessages(args.ids, args.fd)
+    for mode in ('notifier', 'batch'):
+        measure(mode, args, messages)
@@ -4,7 +4,8 @@ import can
 from awsiot.greengrasscoreipc.clientv2 import GreengrassCoreIPCClientV2
 from awsiot.greengrasscoreipc.model import (
     PublishMessage,
-    BinaryMessage
+    BinaryMessage,
+    JsonMessage
 )
 import time
 import traceback
@@ -12,62 +13,269 @@ import threading
 
 import argparse
 
-# Global variables for data aggregation
-successCount = 0
-aggregateData = {
-    'successCount': 0,
-    'errorCount': 0
-}
+from can_stats import CAN_EFF_FLAG, DoubleBufferedStats, formatId
+from dbc_decoder import SignalDecoder
+from histogram import LatencyHistogram
+
+# Per channel and arbitration ID statistics, the CAN thread of each channel counts frames in
+# one window while the publishing thread reads the previous one
+channelStats = {}
 
 TOPIC = 'topic/localGGProc'
 
-def processCan(can):
-    global aggregateData
-    aggregateData['successCount'] += 1
+INGESTION_MODES = ('batch', 'notifier')
+
+# json is the versioned payload, text the PROC lines read by ggStats versions before it
+PAYLOAD_FORMATS = ('json', 'text')
+PAYLOAD_SCHEMA = 'ipcf.proc'
+PAYLOAD_VERSION = 1
+
+def parseId(text):
+    # hex like candump, IDs written with 8 digits are extended
+    text = text.strip()
+    arbitrationId = int(text, 16)
+    return arbitrationId, len(text) == 8
+
+def parseCanFilters(spec):
+    # "<id>:<mask>,...", e.g. "100:7F0,18DA00F1:1FFFFFFF", turned into python-can can_filters
+    # that socketcan installs in the kernel, so frames of the other IDs never reach Python
+    filters = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        idText, maskText = item.split(':')
+        arbitrationId, extended = parseId(idText)
+        filters.append({"can_id": arbitrationId, "can_mask": int(maskText, 16), "extended": extended})
+    return filters or None
+
+def parseSampling(spec):
+    # "<id>:<N>,...", only every Nth frame of the ID is counted, N times
+    sampling = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        idText, rateText = item.split(':')
+        arbitrationId, extended = parseId(idText)
+        sampling[arbitrationId | (CAN_EFF_FLAG if extended else 0)] = int(rateText)
+    return sampling
+
+def ingestBatches(bus, stats, maxBatch, pollTimeout=0.5, stop=None):
+    # Block for one frame, then take whatever else is already queued on the socket without
+    # waiting, and count the whole batch at once, until the stop event is set
+    while stop is None or not stop.is_set():
+        msg = bus.recv(timeout=pollTimeout)
+        if msg is None:
+            continue
+        batch = [msg]
+        while len(batch) < maxBatch:
+            msg = bus.recv(timeout=0)
+            if msg is None:
+                break
+            batch.append(msg)
+        stats.addMessages(batch)
+
+def formatIdStats(channel, idStats):
+    # one line per CAN ID, times in microseconds, the ggStats component ignores the lines it does not know
+    lines = []
+    for arbitrationId, s in sorted(idStats.items()):
+        line = f"CanId {formatId(arbitrationId)} Channel {channel} Frames {s['frames']} Bytes {s['bytes']} Errors {s['errorFrames']}"
+        if s['gapMean'] is not None:
+            line += (f" GapMinUs {s['gapMin'] * 1e6:.0f} GapMaxUs {s['gapMax'] * 1e6:.0f}"
+                     f" GapMeanUs {s['gapMean'] * 1e6:.0f}")
+        if s['jitterMean'] is not None:
+            line += (f" JitterMinUs {s['jitterMin'] * 1e6:.0f} JitterMaxUs {s['jitterMax'] * 1e6:.0f}"
+                     f" JitterMeanUs {s['jitterMean'] * 1e6:.0f}")
+        line += " Dlc " + ",".join(f"{code}:{count}" for code, count in s['dlc'].items())
+        lines.append(line)
+    return lines
+
+def formatSignalStats(channel, window):
+    # one line per decoded signal, in its DBC unit
+    if window.signals is None:
+        return []
+    return [f"Signal {name} Channel {channel} Count {s['count']} Min {s['min']:.6g} Max {s['max']:.6g}"
+            f" Mean {s['mean']:.6g} Last {s['last']:.6g}"
+            for name, s in window.signals.signalStats().items()]
+
+def signalStatsJson(window):
+    if window.signals is None:
+        return []
+    return [dict(name=name, **s) for name, s in window.signals.signalStats().items()]
+
+def formatLatency(name, histogram):
+    # percentiles for the dashboards, the buckets to merge histograms of several windows or devices
+    if not histogram.count:
+        return f"Latency {name} Count 0"
+    return (f"Latency {name} Count {histogram.count} P50Us {histogram.percentile(50)} P95Us {histogram.percentile(95)}"
+            f" P99Us {histogram.percentile(99)} MaxUs {histogram.max} {histogram.format()}")
+
+def latencyJson(histogram):
+    if not histogram.count:
+        return {"count": 0}
+    return {
+        "count": histogram.count,
+        "p50Us": histogram.percentile(50),
+        "p95Us": histogram.percentile(95),
+        "p99Us": histogram.percentile(99),
+        "maxUs": histogram.max,
+        "histogram": histogram.format(),
+    }
+
+def idStatsJson(idStats):
+    ids = []
+    for arbitrationId, s in sorted(idStats.items()):
+        entry = {
+            "id": formatId(arbitrationId),
+            "frames": s['frames'],
+            "bytes": s['bytes'],
+            "errors": s['errorFrames'],
+            "dlc": {str(code): count for code, count in s['dlc'].items()},
+        }
+        if s['gapMean'] is not None:
+            entry["gapUs"] = {"min": round(s['gapMin'] * 1e6), "max": round(s['gapMax'] * 1e6),
+                              "mean": round(s['gapMean'] * 1e6)}
+        if s['jitterMean'] is not None:
+            entry["jitterUs"] = {"min": round(s['jitterMin'] * 1e6), "max": round(s['jitterMax'] * 1e6),
+                                 "mean": round(s['jitterMean'] * 1e6)}
+        ids.append(entry)
+    return ids
+
+def buildJsonPayload(epoch_time, windows, frameLatency, ackLatency):
+    # same content as the text payload, fields are only ever added to a version
+    totalFrames = sum(window.totalFrames for window in windows.values())
+    totalErrorFrames = sum(window.totalErrorFrames for window in windows.values())
+    return {
+        "schema": PAYLOAD_SCHEMA,
+        "version": PAYLOAD_VERSION,
+        "preTs": epoch_time,
+        "dataSizeBits": sum(window.totalBytes for window in windows.values()) * 8,
+        "success": totalFrames - totalErrorFrames,
+        "error": totalErrorFrames,
+        "latency": {
+            "frameToProc": latencyJson(frameLatency),
+            "procToAck": latencyJson(ackLatency),
+        },
+        "channels": [
+            {
+                "name": channel,
+                "dataSizeBits": window.totalBytes * 8,
+                "success": window.totalFrames - window.totalErrorFrames,
+                "error": window.totalErrorFrames,
+                "ids": idStatsJson(window.idStats()),
+                "signals": signalStatsJson(window),
+            }
+            for channel, window in windows.items()
+        ],
+    }
+
+def buildTextPayload(epoch_time, windows, frameLatency, ackLatency):
+    totalBytes = sum(window.totalBytes for window in windows.values())
+    totalFrames = sum(window.totalFrames for window in windows.values())
+    totalErrorFrames = sum(window.totalErrorFrames for window in windows.values())
+    channelLines = [
+        formatLatency("FrameToProc", frameLatency),
+        formatLatency("ProcToAck", ackLatency),
+    ]
+    for channel, window in windows.items():
+        channelLines.append(f"Channel {channel} DataSize {window.totalBytes * 8}"
+                            f" Success {window.totalFrames - window.totalErrorFrames} Error {window.totalErrorFrames}")
+        channelLines += formatIdStats(channel, window.idStats())
+        channelLines += formatSignalStats(channel, window)
+    return "\n".join([
+        "PROC",
+        f"DataSize {totalBytes * 8}",
+        f"Success {totalFrames - totalErrorFrames}",
+        f"Error {totalErrorFrames}",
+        f"PreTS {epoch_time}",
+    ] + channelLines)
 
 def publish_aggregated_data():
-    global ipc_client, aggregateData
+    global ipc_client
+
+    # latency from the processing of the frames of the previous window to the ack of its publish,
+    # only known once it is published
+    ackLatency = LatencyHistogram()
+    frameLatency = LatencyHistogram()
 
     while True:
         time.sleep(int(args.timeout))  # Wait for 10 seconds before publishing
         epoch_time = int(time.time())
 
-        payload = (
-            f"PROC\nDataSize 256\nSuccess {aggregateData['successCount']}\n"
-            f"Error {aggregateData['errorCount']}\nPreTS {epoch_time}"
-        )
+        windows = {channel: stats.swap() for channel, stats in channelStats.items()}
+        frameLatency.reset()
+        for window in windows.values():
+            frameLatency.merge(window.frameLatency)
+        if args.payload_format == 'json':
+            payload = buildJsonPayload(epoch_time, windows, frameLatency, ackLatency)
+            publish_message = PublishMessage(json_message=JsonMessage(message=payload))
+        else:
+            payload = buildTextPayload(epoch_time, windows, frameLatency, ackLatency)
+            publish_message = PublishMessage(binary_message=BinaryMessage(message=bytes(payload, 'utf-8')))
         print(payload)
 
         try:
-            publish_message = PublishMessage(binary_message=BinaryMessage(message=bytes(payload, 'utf-8')))
             ipc_client.publish_to_topic(topic=TOPIC, publish_message=publish_message)
             print(f'Successfully published to topic: {TOPIC}')
+            ackTime = time.time()
+            ackLatency.reset()
+            for window in windows.values():
+                window.recordAckLatency(ackTime, ackLatency)
         except Exception:
             print('Exception occurred')
             traceback.print_exc()
 
-        # Reset aggregated data
-        aggregateData = {
-            'successCount': 0,
-            'errorCount': 0
-        }
+        # Reset aggregated data, the windows become the active ones at the next swap
+        for window in windows.values():
+            window.reset()
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--timeout", default=10)
-args = parser.parse_args()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timeout", default=10)
+    parser.add_argument("--channels", default="can0", help="Comma separated list of the CAN channels captured, e.g. can0,can1,vcan0")
+    parser.add_argument("--interface", default="socketcan", help="python-can interface of the channels")
+    parser.add_argument("--can-filters", default="",
+                        help="Comma separated <id>:<mask> hex filters applied in the kernel, e.g. 100:7F0,18DA00F1:1FFFFFFF")
+    parser.add_argument("--sampling", default="",
+                        help="Comma separated <id>:<N> to count only 1 in N frames of high rate IDs, e.g. 0C9:10")
+    parser.add_argument("--dbc", default="",
+                        help="DBC file of the signals decoded from the frames to publish their statistics, none by default")
+    parser.add_argument("--payload-format", choices=PAYLOAD_FORMATS, default='json',
+                        help="json publishes the versioned JSON message, text the PROC lines understood by older ggStats versions")
+    parser.add_argument("--ingestion", choices=INGESTION_MODES, default='batch',
+                        help="batch drains the CAN socket and counts the frames in bulk, notifier counts them one callback at a time")
+    parser.add_argument("--max-batch", type=int, default=1024, help="Maximum number of frames counted at once in batch mode")
+    args = parser.parse_args()
 
-try:
-    ipc_client = GreengrassCoreIPCClientV2()
-    bus = can.interface.Bus(channel='can0', bustype='socketcan')
-    notifier = can.Notifier(bus, [processCan])
+    try:
+        ipc_client = GreengrassCoreIPCClientV2()
+        canFilters = parseCanFilters(args.can_filters)
+        sampling = parseSampling(args.sampling)
+        decoder = None
+        if args.dbc:
+            decoder = SignalDecoder.fromFile(args.dbc)
+            print(f"Decoding {len(decoder.signals)} signals of {len(decoder.messages)} messages from {args.dbc}")
+            if decoder.skipped:
+                print(f"Skipped the unsupported signals {', '.join(decoder.skipped)}")
+        buses = {}
+        for channel in [c.strip() for c in args.channels.split(',') if c.strip()]:
+            buses[channel] = can.interface.Bus(channel=channel, interface=args.interface, can_filters=canFilters)
+            channelStats[channel] = DoubleBufferedStats(sampling=sampling, window=float(args.timeout), decoder=decoder)
+        # one ingestion thread per channel, each the only writer of its channel's stats
+        notifiers = []
+        for channel, bus in buses.items():
+            if args.ingestion == 'notifier':
+                notifiers.append(can.Notifier(bus, [channelStats[channel].addMessage]))
+            else:
+                threading.Thread(target=ingestBatches, args=(bus, channelStats[channel], args.max_batch),
+                                 daemon=True).start()
 
-    # Start the periodic data publish thread
-    threading.Thread(target=publish_aggregated_data, daemon=True).start()
+        # Start the periodic data publish thread
+        threading.Thread(target=publish_aggregated_data, daemon=True).start()
 
-except Exception:
-    print("Failed to connect to CAN, should retry \n")
-    traceback.print_exc()
+    except Exception:
+        print("Failed to connect to CAN, should retry \n")
+        traceback.print_exc()
 
-# Main loop
-while True:
-    time.sleep(1)  # To keep the main thread alive
+    # Main loop
+    while True:
+        time.sleep(1)  # To keep the main thread alive
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Stress test of the lock-free window swap of can_stats.DoubleBufferedStats.
+
+Frames are sent on a python-can virtual bus and counted by a can.Notifier listener, or in
+batches with --ingestion batch, like the component does, while another thread keeps swapping the aggregation windows. Every
+frame must show up in exactly one window: the script fails if the published totals, per
+ID and overall, do not add up to what was sent.
+
+    python3 stress_test.py --frames 2000000 --window-ms 5
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+
+import can
+
+from can_stats import DoubleBufferedStats
+from ipcf_shared_memory_replacement import ingestBatches
+
+
+def publishWindows(stats, windowMs, totals, perId, stop):
+    # what publish_aggregated_data does, with a much shorter window to provoke races
+    while True:
+        stopping = stop.is_set()
+        time.sleep(windowMs / 1000.0)
+        window = stats.swap()
+        totals['frames'] += window.totalFrames
+        totals['bytes'] += window.totalBytes
+        totals['windows'] += 1
+        for arbitrationId, idStats in window.idStats().items():
+            perId[arbitrationId] += idStats['frames']
+        window.reset()
+        if stopping:
+            return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=1000000, help='Number of frames sent')
+    parser.add_argument('--ids', type=int, default=64, help='Number of distinct standard IDs, plus as many extended ones')
+    parser.add_argument('--window-ms', type=float, default=5, help='Aggregation window length')
+    parser.add_argument('--ingestion', choices=('notifier', 'batch'), default='notifier', help='How frames are counted')
+    parser.add_argument('--max-batch', type=int, default=1024, help='Maximum number of frames counted at once')
+    args = parser.parse_args()
+
+    # switch threads as often as possible so that swaps land in the middle of counting a frame
+    sys.setswitchinterval(1e-6)
+
+    stats = DoubleBufferedStats()
+    receiver = can.Bus(interface='virtual', channel='ipcf-stress')
+    sender = can.Bus(interface='virtual', channel='ipcf-stress')
+    totals = Counter()
+    perId = Counter()
+    stop = threading.Event()
+    ingestStop = threading.Event()
+    if args.ingestion == 'notifier':
+        notifier = can.Notifier(receiver, [stats.addMessage])
+    else:
+        ingester = threading.Thread(target=ingestBatches, args=(receiver, stats, args.max_batch, 0.05, ingestStop))
+        ingester.start()
+    publisher = threading.Thread(target=publishWindows, args=(stats, args.window_ms, totals, perId, stop))
+    publisher.start()
+
+    sent = Counter()
+    sentBytes = 0
+    messages = []
+    for i in range(args.ids):
+        messages.append(can.Message(arbitration_id=0x100 + i, is_extended_id=False, data=bytes(i % 9)))
+        messages.append(can.Message(arbitration_id=0x18DA0000 + i, is_extended_id=True, data=bytes(8)))
+    start = time.monotonic()
+    for i in range(args.frames):
+        msg = messages[i % len(messages)]
+        sender.send(msg)
+        sent[msg.arbitration_id | (0x80000000 if msg.is_extended_id else 0)] += 1
+        sentBytes += len(msg.data)
+    sendTime = time.monotonic() - start
+
+    # wait for the notifier to drain the virtual bus
+    while receiver.queue.qsize():
+        time.sleep(0.05)
+    time.sleep(0.1)
+    if args.ingestion == 'notifier':
+        notifier.stop()
+    else:
+        ingestStop.set()
+        ingester.join()
+    stop.set()
+    publisher.join()
+    sender.shutdown()
+    receiver.shutdown()
+    elapsed = time.monotonic() - start
+
+    print(f"sent {args.frames} frames in {sendTime:.1f}s, counted over {totals['windows']} windows in {elapsed:.1f}s"
+          f" ({totals['frames'] / elapsed:,.0f} frames/s)")
+    errors = []
+    if totals['frames'] != args.frames:
+        errors.append(f"counted {totals['frames']} frames, {args.frames - totals['frames']} lost")
+    if totals['bytes'] != sentBytes:
+        errors.append(f"counted {totals['bytes']} bytes instead of {sentBytes}")
+    if perId != sent:
+        diff = {hex(k): perId[k] - sent[k] for k in set(perId) | set(sent) if perId[k] != sent[k]}
+        errors.append(f"per ID totals differ: {diff}")
+    for error in errors:
+        print("FAILED:", error)
+    if errors:
+        sys.exit(1)
+    print("OK: every frame was counted in exactly one window")
@@ -32,8 +32,12 @@ export class HandlerRole extends Construct {
         'iot:DescribeThing',
         'iot:CreateThing',
         'iot:CreateKeysAndCertificate',
+        'iot:AttachThingPrincipal',
+        'iot:AttachPolicy',
         'iot:DescribeEndpoint',
         'iot:ListThingPrincipals',
+        'iot:DetachThingPrincipal',
+        'iot:UpdateCertificate',
         'iot:DeleteCertificate',
         'iot:DeleteThing',
         'timestream:DescribeEndpoints',
@@ -1,24 +1,17 @@
 import json
-import time
 import logging as logger
-import boto3
-import os
+from clients import LazyClient
+from waiter import CAMPAIGN_WAITING_FOR_APPROVAL, CAMPAIGN_RUNNING, CAMPAIGN_SUSPENDED, wait_for_status
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
 
 def on_event(event, context):
     logger.info(f"on_event {event} {context}")
     request_type = event['RequestType']
     if request_type == 'Create':
-        return on_create(event)
+        return on_create(event, context)
     if request_type == 'Update':
         return on_update(event)
     if request_type == 'Delete':
@@ -26,7 +19,7 @@ def on_event(event, context):
     raise Exception("Invalid request type: {request_type}")
 
 
-def on_create(event):
+def on_create(event, context):
     props = event["ResourceProperties"]
     logger.info(f"create new resource with props {props}")
 
@@ -81,22 +74,19 @@ def on_create(event):
         logger.info(f"create_campaign response {response}")
 
     if props['auto_approve'] == 'true':
-        retry_count = 10;
-        delay = 2;
-        while retry_count > 1:
-            print(f"waiting for campaign {props['name']} to be created")
-            response = client.get_campaign(name=props['name'])
-            print(f"get_campaign response {response}")
-            if response['status'] == "WAITING_FOR_APPROVAL":
-                break
-            time.sleep(delay)
-            retry_count = retry_count - 1
-        print(f"approving the campaign {props['name']}")
-        response = client.update_campaign(
-            name=props['name'],
-            action='APPROVE'
-        )
-        logger.info(f"update_campaign response {response}")
+        # a campaign that was already approved by a previous attempt is RUNNING or SUSPENDED
+        response = wait_for_status(
+            lambda: client.get_campaign(name=props['name']),
+            [CAMPAIGN_WAITING_FOR_APPROVAL, CAMPAIGN_RUNNING, CAMPAIGN_SUSPENDED],
+            context=context,
+            description=f"campaign {props['name']}")
+        if response['status'] == CAMPAIGN_WAITING_FOR_APPROVAL:
+            print(f"approving the campaign {props['name']}")
+            response = client.update_campaign(
+                name=props['name'],
+                action='APPROVE'
+            )
+            logger.info(f"update_campaign response {response}")
     return {'PhysicalResourceId': props['name']}
 
 
@@ -0,0 +1,58 @@
+import os
+import threading
+
+from parallel import MAX_WORKERS
+
+CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
+
+# boto3 is imported and the clients built on first use, not when a handler module is loaded
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+def _config():
+    from botocore.config import Config
+    return Config(
+        # one connection per concurrent call
+        max_pool_connections=MAX_WORKERS,
+        # the only retries of throttled calls, with client side rate limiting shared by the threads
+        retries={'mode': 'adaptive', 'max_attempts': 10},
+        connect_timeout=5,
+        read_timeout=30,
+    )
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.Session()
+        if CUSTOM_ENDPOINT is not None:
+            _session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
+    return _session
+
+def get_client(service, endpoint_url=None):
+    """Client of service, created once per (service, endpoint) and shared by the threads of the invocation.
+
+    The iotfleetwise client uses the FW_ENDPOINT_URL endpoint when it is set.
+    """
+    if endpoint_url is None and service == 'iotfleetwise':
+        endpoint_url = CUSTOM_ENDPOINT
+    key = (service, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service, endpoint_url=endpoint_url, config=_config())
+                _clients[key] = client
+    return client
+
+class LazyClient:
+    """Stand-in for the client of a service, created by get_client on first use."""
+
+    def __init__(self, service, endpoint_url=None):
+        self._service = service
+        self._endpoint_url = endpoint_url
+
+    def __getattr__(self, name):
+        return getattr(get_client(self._service, self._endpoint_url), name)
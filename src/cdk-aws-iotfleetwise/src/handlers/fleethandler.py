@@ -1,18 +1,15 @@
 from pydoc import describe
-from collections import Counter
 import logging as logger
-import boto3
-import os
+from clients import LazyClient
+from botocore.exceptions import ClientError
+from parallel import error_code, pages, prefetched, run_concurrently, raise_failures
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
+
+# listings of the fleet on delete, a listing paged by offset skips about half of the vehicles left per pass
+MAX_DISASSOCIATE_PASSES = 20
 
 #client = session.client("iotfleetwise", region_name='us-west-2', endpoint_url='https://controlplane.us-west-2.gamma.kaleidoscope.iot.aws.dev')
 
@@ -27,6 +24,65 @@ def on_event(event, context):
         return on_delete(event)
     raise Exception("Invalid request type: {request_type}")
 
+def associate(fleet_id, name):
+    # idempotent, a vehicle already in the fleet is left as is
+    logger.info(f"associating vehicle {name} to fleet {fleet_id}")
+    try:
+        response = client.associate_vehicle_fleet(fleetId = fleet_id, vehicleName = name)
+    except ClientError as e:
+        if error_code(e) != 'ConflictException':
+            raise
+        logger.info(f"vehicle {name} already in fleet {fleet_id}")
+        return None
+    logger.info(f"associate_vehicle response {response}")
+    return response
+
+def disassociate(fleet_id, name):
+    # idempotent, a vehicle already out of the fleet is left as is
+    logger.info(f"disassociate_vehicle_fleet {name} from {fleet_id}")
+    try:
+        response = client.disassociate_vehicle_fleet(fleetId = fleet_id, vehicleName = name)
+    except ClientError as e:
+        if error_code(e) != 'ResourceNotFoundException':
+            raise
+        logger.info(f"vehicle {name} already not in fleet {fleet_id}")
+        return None
+    logger.info(f"disassociate_vehicle_fleet response {response}")
+    return response
+
+def associate_vehicles(fleet_id, vehicle_names):
+    succeeded, failures = run_concurrently(lambda name: associate(fleet_id, name), vehicle_names)
+    logger.info(f"associated {succeeded} vehicles to fleet {fleet_id}, {len(failures)} failed")
+    raise_failures(f"associate_vehicle_fleet to {fleet_id}", failures)
+
+def disassociate_vehicles(fleet_id, vehicle_names):
+    # the number of vehicles actually removed, vehicles already out of the fleet are not counted
+    removed = 0
+
+    def count(name, response):
+        nonlocal removed
+        if response is not None:
+            removed += 1
+
+    succeeded, failures = run_concurrently(lambda name: disassociate(fleet_id, name), vehicle_names, on_result=count)
+    logger.info(f"disassociated {removed} vehicles from fleet {fleet_id}, {succeeded - removed} already out, {len(failures)} failed")
+    raise_failures(f"disassociate_vehicle_fleet from {fleet_id}", failures)
+    return removed
+
+def fleet_vehicles(fleet_id):
+    # the vehicles of the fleet page by page, the next page being fetched while the current one is processed
+    for page in prefetched(pages(client.list_vehicles_in_fleet, "vehicles", fleetId = fleet_id)):
+        logger.info(f"list_vehicles_in_fleet page of {len(page)} vehicles")
+        yield from page
+
+def disassociate_all_vehicles(fleet_id):
+    # removing vehicles can shift the pages still to be listed, so list again while a pass removes vehicles;
+    # a listing that keeps returning vehicles the service says are not in the fleet does not count
+    for _ in range(MAX_DISASSOCIATE_PASSES):
+        if not disassociate_vehicles(fleet_id, fleet_vehicles(fleet_id)):
+            return
+    logger.warning(f"fleet {fleet_id} still listed vehicles after {MAX_DISASSOCIATE_PASSES} passes")
+
 def on_create(event):
     props = event["ResourceProperties"]
     logger.info(f"create new resource with props {props}")
@@ -38,39 +94,55 @@ def on_create(event):
     )
     logger.info(f"create_fleet response {response}")
     
-    for name in props['vehicle_names']:
-      logger.info(f"associating vehicle {name} to fleet {props['fleet_id']}")    
-      response = client.associate_vehicle_fleet(
-        fleetId = props['fleet_id'],
-        vehicleName = name,
-      )
-      logger.info(f"associate_vehicle response {response}")   
+    associate_vehicles(props['fleet_id'], props['vehicle_names'])
 
     return { 'PhysicalResourceId': props['fleet_id'] }
 
+def update_vehicles(fleet_id, old_names, new_names):
+    # only the vehicles that changed cost an API call, adds and removes run together
+    old_names = set(old_names)
+    new_names = set(new_names)
+    changes = [('add', name) for name in new_names - old_names] + [('remove', name) for name in old_names - new_names]
+    logger.info(f"fleet {fleet_id}: adding {len(new_names - old_names)} vehicles, removing {len(old_names - new_names)}")
+
+    def apply(change):
+        operation, name = change
+        return associate(fleet_id, name) if operation == 'add' else disassociate(fleet_id, name)
+
+    changed = {'add': [], 'remove': []}
+    succeeded, failures = run_concurrently(apply, changes, on_result=lambda change, _: changed[change[0]].append(change[1]))
+    logger.info(f"fleet {fleet_id}: added {sorted(changed['add'])}, removed {sorted(changed['remove'])}")
+    raise_failures(f"update of fleet {fleet_id}", failures)
+    return changed
+
 def on_update(event):
     physical_id = event["PhysicalResourceId"]
     props = event["ResourceProperties"]
     old_props = event["OldResourceProperties"]
-    c = Counter(props['vehicle_names'])
-    c.subtract(old_props['vehicle_names'])
-    for vehicleName, operation in c.items():
-        if operation == -1:
-            logger.info(f"removing {vehicleName} to {props['fleet_id']}")
-            response = client.disassociate_vehicle_fleet(
-                fleetId = props['fleet_id'],
-                vehicleName = vehicleName)
-            logger.info(f"disassociate_vehicle response {response}")
-        elif operation == 1:
-            logger.info(f"adding {vehicleName} to {props['fleet_id']}")
-            response = client.associate_vehicle_fleet(
-                fleetId = props['fleet_id'],
-                vehicleId = vehicleName)
-            logger.info(f"associate_vehicle response {response}")            
-        
     logger.info(f"update resource {physical_id} with props {props}")
-    #raise Exception("update not implemented yet")
-    return { 'PhysicalResourceId': physical_id }
+
+    if props['fleet_id'] != old_props['fleet_id']:
+        # a new fleet replaces the old one, which CloudFormation then deletes
+        logger.info(f"replacing fleet {old_props['fleet_id']} with {props['fleet_id']}")
+        return on_create(event)
+
+    if props['signal_catalog_arn'] != old_props['signal_catalog_arn']:
+        # the signal catalog of a fleet cannot be updated, and a fleet ID cannot be created twice
+        raise Exception(f"the signal catalog of fleet {props['fleet_id']} cannot be changed, "
+                        "set a new fleet_id to replace the fleet")
+
+    if props['description'] != old_props['description']:
+        response = client.update_fleet(fleetId = props['fleet_id'], description = props['description'])
+        logger.info(f"update_fleet response {response}")
+
+    changed = update_vehicles(props['fleet_id'], old_props['vehicle_names'], props['vehicle_names'])
+    return {
+        'PhysicalResourceId': physical_id,
+        'Data': {
+            'vehicles_added': len(changed['add']),
+            'vehicles_removed': len(changed['remove']),
+        },
+    }
 
 def on_delete(event):
     physical_id = event["PhysicalResourceId"]
@@ -78,14 +150,7 @@ def on_delete(event):
     logger.info(f"delete resource {props['fleet_id']} {physical_id}")
 
     logger.info(f"list_vehicles_in_fleet {props['fleet_id']}")
-    response = client.list_vehicles_in_fleet(fleetId = props['fleet_id'])
-    logger.info(f"list_vehicles_in_fleet response {response}")
-    for v in response["vehicles"]:
-        logger.info(f"disassociate_vehicle_fleet {v} from {props['fleet_id']}")
-        response = client.disassociate_vehicle_fleet(
-            fleetId = props['fleet_id'],
-            vehicleName = v)
-        logger.info(f"disassociate_vehicle_fleet response {response}")
+    disassociate_all_vehicles(props['fleet_id'])
 
     logger.info(f"delete_fleet {props['fleet_id']}")    
     response = client.delete_fleet(
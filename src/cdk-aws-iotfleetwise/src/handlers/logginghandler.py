@@ -1,17 +1,10 @@
 import logging as logger
-import botocore
-import boto3
-import os
+from clients import LazyClient
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    fleetwise_client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    fleetwise_client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+fleetwise_client = LazyClient('iotfleetwise')
+logs_client = LazyClient('logs')
 
 
 def on_event(event, context):
@@ -32,7 +25,6 @@ def on_create(event, context):
     ret = {"PhysicalResourceId": props["cloudwatch_log_group_name"]}
 
     # check if log group exists and create if is doesn't
-    logs_client = boto3.client("logs")
     response = logs_client.describe_log_groups(
         logGroupNamePattern=props["cloudwatch_log_group_name"],
     )
@@ -68,7 +60,6 @@ def on_delete(event):
     logger.info(
         f"delete FleetWise logging {props['cloudwatch_log_group_name']} {physical_id}"
     )
-    logs_client = boto3.client("logs")
 
     if props["keep_log_group"] != "true":
         # first turn off logging for FleetWise
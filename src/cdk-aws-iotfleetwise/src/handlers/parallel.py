@@ -0,0 +1,93 @@
+import logging as logger
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+# number of API calls the handlers run concurrently, configurable with the FW_MAX_WORKERS environment variable
+MAX_WORKERS = int(os.getenv('FW_MAX_WORKERS', '16'))
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code') if isinstance(error, ClientError) else None
+
+def call_with_retry(function, *args, retryable, max_attempts=8, base_delay=0.2, max_delay=10.0, **kwargs):
+    """Call function(*args, **kwargs), retrying the error codes of retryable with exponential backoff and full jitter.
+
+    For calls that fail until an earlier asynchronous change is applied. Throttling is not
+    retried here, the clients of clients.get_client already retry it in adaptive mode.
+    """
+    attempt = 1
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except ClientError as e:
+            if error_code(e) not in retryable or attempt >= max_attempts:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            logger.info(f"{e.response['Error']['Code']} on attempt {attempt}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+def pages(function, key, **kwargs):
+    """Yield the key list of every page of a paginated API call, following nextToken."""
+    while True:
+        response = function(**kwargs)
+        yield response.get(key, [])
+        if not response.get('nextToken'):
+            return
+        kwargs['nextToken'] = response['nextToken']
+
+def prefetched(iterator):
+    """Yield the items of iterator, computing the next one in the background while the current one is used."""
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        future = fetcher.submit(next, iterator, None)
+        while True:
+            item = future.result()
+            if item is None:
+                return
+            future = fetcher.submit(next, iterator, None)
+            yield item
+
+def run_concurrently(function, items, max_workers=MAX_WORKERS, on_result=None):
+    """Call function(item) for every item with at most max_workers calls in flight.
+
+    items can be any iterable, it is consumed as calls complete so that a generator of any
+    length is handled in constant memory. on_result(item, result) is called for every
+    success, from the calling thread. Returns the number of successes and the failures keyed
+    by item, a failure being the exception raised for the item once the retries of its client
+    were exhausted.
+    """
+    succeeded = 0
+    failures = {}
+    in_flight = {}
+
+    def collect(futures):
+        nonlocal succeeded
+        for future in futures:
+            item = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"{item} failed: {e}")
+                failures[item] = e
+                continue
+            succeeded += 1
+            if on_result is not None:
+                on_result(item, result)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            if len(in_flight) >= 2 * max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(function, item)] = item
+        collect(list(in_flight))
+    return succeeded, failures
+
+def raise_failures(action, failures):
+    if failures:
+        details = "; ".join(f"{item}: {error}" for item, error in list(failures.items())[:20])
+        more = f" and {len(failures) - 20} more" if len(failures) > 20 else ""
+        raise Exception(f"{action} failed for {len(failures)} items: {details}{more}")
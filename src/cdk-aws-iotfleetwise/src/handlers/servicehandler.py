@@ -1,16 +1,9 @@
 import logging as logger
-import boto3
-import os
+from clients import LazyClient
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
 
 def on_event(event, context):
     logger.info(event)
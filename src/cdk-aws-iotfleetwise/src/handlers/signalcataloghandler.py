@@ -1,17 +1,10 @@
 import logging as logger
-import boto3
+from clients import LazyClient
 import json
-import os
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
 
 def on_event(event, context):
     logger.info(event)
@@ -36,12 +29,55 @@ def on_create(event):
     logger.info(f"create signal catalog response: {response}")
     return { 'PhysicalResourceId': props['name'] }
 
+# maximum number of nodes of an update_signal_catalog call
+UPDATE_NODES_SIZE = 500
+# node types other nodes are declared under or refer to, created first and removed last
+CONTAINER_TYPES = ('branch', 'struct', 'property')
+
+def node_name(node):
+    # a node is {type: {'fullyQualifiedName': ..., ...}}
+    return next(iter(node.values()))['fullyQualifiedName']
+
+def node_order(node):
+    # containers before the nodes that use them, parents before children
+    return (next(iter(node)) not in CONTAINER_TYPES, node_name(node).count('.'))
+
+def diff_nodes(old_nodes, new_nodes):
+    """Nodes to add, nodes to update and names of the nodes to remove to go from old_nodes to new_nodes."""
+    old = {node_name(node): node for node in old_nodes}
+    new = {node_name(node): node for node in new_nodes}
+    to_add = sorted((node for name, node in new.items() if name not in old), key=node_order)
+    to_update = sorted((node for name, node in new.items() if name in old and node != old[name]), key=node_order)
+    to_remove = [node_name(node) for node in sorted((node for name, node in old.items() if name not in new),
+                                                     key=node_order, reverse=True)]
+    return to_add, to_update, to_remove
+
 def on_update(event):
     physical_id = event["PhysicalResourceId"]
     props = event["ResourceProperties"]
+    old_props = event["OldResourceProperties"]
     logger.info(f"update resource {physical_id} with props {props}")
-    raise Exception("update not implemented yet")
-    #return { 'PhysicalResourceId': physical_id }
+    if props['name'] != old_props['name']:
+        # a new catalog, CloudFormation deletes the old one when the stack update completes
+        return on_create(event)
+
+    to_add, to_update, to_remove = diff_nodes(json.loads(old_props['nodes']), json.loads(props['nodes']))
+    logger.info(f"adding {len(to_add)}, updating {len(to_update)} and removing {len(to_remove)} nodes")
+    requests = [{'nodesToAdd': to_add[i:i + UPDATE_NODES_SIZE]} for i in range(0, len(to_add), UPDATE_NODES_SIZE)]
+    requests += [{'nodesToUpdate': to_update[i:i + UPDATE_NODES_SIZE]}
+                 for i in range(0, len(to_update), UPDATE_NODES_SIZE)]
+    requests += [{'nodesToRemove': to_remove[i:i + UPDATE_NODES_SIZE]}
+                 for i in range(0, len(to_remove), UPDATE_NODES_SIZE)]
+    if props['description'] != old_props['description']:
+        if not requests:
+            requests.append({})
+        requests[0]['description'] = props['description']
+
+    # in order, a chunk can depend on the nodes of the previous ones
+    for request in requests:
+        response = client.update_signal_catalog(name=props['name'], **request)
+        logger.info(f"update signal catalog response: {response}")
+    return { 'PhysicalResourceId': physical_id }
 
 def on_delete(event):
     physical_id = event["PhysicalResourceId"]
@@ -1,19 +1,25 @@
 import json
 import logging as logger
-import boto3
-import os
+from botocore.exceptions import ClientError
+from clients import LazyClient
+from parallel import call_with_retry, error_code, pages, run_concurrently, raise_failures
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
 
-client_iot = boto3.client("iot")
+client_iot = LazyClient("iot")
+client_s3 = LazyClient("s3")
+
+# maximum number of vehicles of a batch_create_vehicle call
+BATCH_CREATE_VEHICLE_SIZE = 10
+# failed vehicles named in the response, which CloudFormation limits to 4 KB
+MAX_FAILED_NAMES = 20
+# errors of deletes made before the detach of a principal is applied
+CERTIFICATE_ATTACHED_ERRORS = ("CertificateStateException", "DeleteConflictException")
+THING_ATTACHED_ERRORS = ("InvalidRequestException",)
+
+_endpoint_address = None
 
 def on_event(event, context):
     logger.info(f"on_event {event} {context}")
@@ -27,9 +33,20 @@ def on_event(event, context):
     raise Exception("Invalid request type: {request_type}")
 
 
+def endpoint_address():
+    global _endpoint_address
+    if _endpoint_address is None:
+        response = client_iot.describe_endpoint(endpointType="iot:Data-ATS")
+        logger.info(f"describe_endpoint response {response}")
+        _endpoint_address = response["endpointAddress"]
+    return _endpoint_address
+
+
 def on_create(event, context):
     props = event["ResourceProperties"]
     logger.info(f"create new resource with props {props}")
+    if "vehicles" in props:
+        return create_vehicles(event)
     ret = {"PhysicalResourceId": props["vehicle_name"]}
 
     if props["create_iot_thing"] == "true":
@@ -42,9 +59,7 @@ def on_create(event, context):
             "certificatePem": response_iot["certificatePem"],
             "privateKey": response_iot["keyPair"]["PrivateKey"],
         }
-        response = client_iot.describe_endpoint(endpointType="iot:Data-ATS")
-        logger.info(f"describe_endpoint response {response}")
-        ret["Data"]["endpointAddress"] = response["endpointAddress"]
+        ret["Data"]["endpointAddress"] = endpoint_address()
 
     response = client.create_vehicle(
         associationBehavior="CreateIotThing" if (props["create_iot_thing"] == "true") else "ValidateIotThingExists",
@@ -57,6 +72,108 @@ def on_create(event, context):
     return ret
 
 
+def bulk_vehicles(props):
+    """(name, attributes) of the vehicles prop, a list of vehicle names or of {"vehicle_name", "attributes"}."""
+    vehicles = props["vehicles"]
+    if isinstance(vehicles, str):
+        vehicles = json.loads(vehicles)
+    return [(v, {}) if isinstance(v, str) else (v["vehicle_name"], v.get("attributes") or {}) for v in vehicles]
+
+
+def create_vehicles(event):
+    """Bulk mode: create the vehicles of the vehicles prop with batch_create_vehicle.
+
+    With create_iot_thing, every vehicle gets its own certificate, attached to its thing and
+    to the policy_name policy when given. The certificate and private key of a vehicle are
+    written to <certificates_prefix><vehicle>/certificate.pem and private-key.key in the
+    certificates_bucket bucket, and the result of every vehicle to
+    <certificates_prefix>results.json. A vehicle that fails is reported, and does not fail
+    the others.
+    """
+    props = event["ResourceProperties"]
+    create_iot_thing = props.get("create_iot_thing") == "true"
+    bucket = props.get("certificates_bucket")
+    prefix = props.get("certificates_prefix", "")
+    if create_iot_thing and not bucket:
+        raise Exception("certificates_bucket is required to create the iot things of vehicles")
+    vehicles = bulk_vehicles(props)
+    results = {name: {"status": "FAILED"} for name, _ in vehicles}
+
+    # a batch is the range of its vehicles, the failures of run_concurrently are keyed by batch
+    def create_batch(batch):
+        response = client.batch_create_vehicle(vehicles=[
+            {
+                "vehicleName": name,
+                "modelManifestArn": props["model_manifest_arn"],
+                "decoderManifestArn": props["decoder_manifest_arn"],
+                "attributes": attributes,
+                "associationBehavior": "CreateIotThing" if create_iot_thing else "ValidateIotThingExists",
+            }
+            for name, attributes in vehicles[batch[0]:batch[1]]
+        ])
+        logger.info(f"batch_create_vehicle response {response}")
+        return response
+
+    def on_batch(batch, response):
+        for vehicle in response.get("vehicles", []):
+            results[vehicle["vehicleName"]] = {"status": "CREATED", "arn": vehicle["arn"]}
+        for error in response.get("errors", []):
+            results[error["vehicleName"]]["error"] = f"{error.get('code')}: {error.get('message')}"
+
+    batches = ((i, min(i + BATCH_CREATE_VEHICLE_SIZE, len(vehicles)))
+               for i in range(0, len(vehicles), BATCH_CREATE_VEHICLE_SIZE))
+    _, failures = run_concurrently(create_batch, batches, on_result=on_batch)
+    for batch, error in failures.items():
+        for name, _ in vehicles[batch[0]:batch[1]]:
+            results[name]["error"] = str(error)
+
+    data = {}
+    if create_iot_thing:
+        data["endpointAddress"] = endpoint_address()
+
+        def create_certificate(name):
+            response = client_iot.create_keys_and_certificate(setAsActive=True)
+            certificate_arn = response["certificateArn"]
+            try:
+                client_iot.attach_thing_principal(thingName=name, principal=certificate_arn)
+                if props.get("policy_name"):
+                    client_iot.attach_policy(policyName=props["policy_name"], target=certificate_arn)
+                client_s3.put_object(Bucket=bucket, Key=f"{prefix}{name}/certificate.pem",
+                                     Body=response["certificatePem"].encode())
+                client_s3.put_object(Bucket=bucket, Key=f"{prefix}{name}/private-key.key",
+                                     Body=response["keyPair"]["PrivateKey"].encode())
+            except Exception:
+                # the delete only finds the certificates attached to the thing, do not leave this one behind
+                logger.error(f"deleting certificate {certificate_arn} of {name}")
+                try:
+                    delete_principal(name, certificate_arn)
+                except Exception as e:
+                    logger.error(f"certificate {certificate_arn} of {name} left behind: {e}")
+                    results[name]["leftCertificateArn"] = certificate_arn
+                raise
+            results[name]["certificateArn"] = certificate_arn
+            results[name]["certificateId"] = response["certificateId"]
+
+        created = [name for name, result in results.items() if result["status"] == "CREATED"]
+        _, failures = run_concurrently(create_certificate, created)
+        for name, error in failures.items():
+            results[name]["status"] = "FAILED"
+            results[name]["error"] = str(error)
+
+    if bucket:
+        client_s3.put_object(Bucket=bucket, Key=f"{prefix}results.json",
+                             Body=json.dumps(results, indent=2).encode())
+        data["results"] = f"s3://{bucket}/{prefix}results.json"
+    failed = [name for name, result in results.items() if result["status"] == "FAILED"]
+    for name in failed[:MAX_FAILED_NAMES]:
+        logger.error(f"vehicle {name} failed: {results[name].get('error')}")
+    data["created"] = len(results) - len(failed)
+    data["failed"] = len(failed)
+    data["failedVehicles"] = ",".join(failed[:MAX_FAILED_NAMES])
+    logger.info(f"created {data['created']} of {len(results)} vehicles")
+    return {"PhysicalResourceId": props.get("name", event["LogicalResourceId"]), "Data": data}
+
+
 def on_update(event):
     physical_id = event["PhysicalResourceId"]
     props = event["ResourceProperties"]
@@ -65,24 +182,80 @@ def on_update(event):
     # return { 'PhysicalResourceId': physical_id }
 
 
+def ignore_not_found(function, **kwargs):
+    # the step was done by a previous attempt
+    try:
+        return function(**kwargs)
+    except ClientError as e:
+        if error_code(e) != "ResourceNotFoundException":
+            raise
+        logger.info(f"{function.__name__} {kwargs}: already done")
+        return None
+
+
+def delete_principal(name, principal):
+    logger.info(f"detach_thing_principal {principal} from {name}")
+    ignore_not_found(client_iot.detach_thing_principal, thingName=name, principal=principal)
+    if ":cert/" not in principal:
+        return
+    certificate_id = principal.split("/")[-1]
+    ignore_not_found(client_iot.update_certificate, certificateId=certificate_id, newStatus="INACTIVE")
+    # the detach is asynchronous, the delete fails until it is applied
+    try:
+        call_with_retry(client_iot.delete_certificate, certificateId=certificate_id, forceDelete=True,
+                        retryable=CERTIFICATE_ATTACHED_ERRORS)
+    except ClientError as e:
+        if error_code(e) != "ResourceNotFoundException":
+            raise
+    logger.info(f"deleted certificate {certificate_id}")
+
+
+def delete_thing(name):
+    """Detach, deactivate and delete the certificates of a thing concurrently, then delete the thing.
+
+    Every step accepts the state a previous attempt left, so a failed delete can be retried.
+    """
+    principals = [principal for page in pages(client_iot.list_thing_principals, "principals", thingName=name)
+                  for principal in page]
+    logger.info(f"thing {name} principals {principals}")
+    _, failures = run_concurrently(lambda principal: delete_principal(name, principal), principals)
+    raise_failures(f"delete of the certificates of {name}", failures)
+
+    call_with_retry(client_iot.delete_thing, thingName=name, retryable=THING_ATTACHED_ERRORS)
+    logger.info(f"deleted thing {name}")
+
+
+def delete_vehicle(name, delete_iot_thing):
+    # a vehicle of a bulk create that failed was never created, or a previous attempt deleted it
+    logger.info(f"delete_vehicle {name}")
+    try:
+        response = client.delete_vehicle(vehicleName=name)
+        logger.info(f"delete_vehicle response {response}")
+    except ClientError as e:
+        if error_code(e) != "ResourceNotFoundException":
+            raise
+    if delete_iot_thing:
+        try:
+            delete_thing(name)
+        except ClientError as e:
+            if error_code(e) != "ResourceNotFoundException":
+                raise
+            logger.info(f"thing {name} already deleted")
+
+
 def on_delete(event):
     physical_id = event["PhysicalResourceId"]
     props = event["ResourceProperties"]
-    logger.info(f"delete resource {props['vehicle_name']} {physical_id}")
+    if "vehicles" in props:
+        logger.info(f"delete vehicles {physical_id}")
+        names = [name for name, _ in bulk_vehicles(props)]
+        delete_iot_thing = props.get("create_iot_thing") == "true"
+        succeeded, failures = run_concurrently(lambda name: delete_vehicle(name, delete_iot_thing), names)
+        logger.info(f"deleted {succeeded} vehicles")
+        raise_failures("delete_vehicle", failures)
+        return {"PhysicalResourceId": physical_id}
 
-    response = client.delete_vehicle(vehicleName=props["vehicle_name"])
-    logger.info(f"delete_vehicle response {response}")
+    logger.info(f"delete resource {props['vehicle_name']} {physical_id}")
 
-    if props["create_iot_thing"] == "true":
-        response_iot = client_iot.list_thing_principals(thingName=props["vehicle_name"])
-        logger.info(f"list_thing_principals response {response_iot}")
-
-        for cert in response_iot["principals"]:
-            logger.info(f"delete_certificate {cert}")
-            response_delete = client_iot.delete_certificate(certificateId=cert, forceDelete=True)
-            logger.info(f"delete_certificate response {response_delete}")
-
-        logger.info(f"delete_thing")
-        response_delete_thing = client_iot.delete_thing(thingName=props["vehicle_name"])
-        logger.info(f"delete_thing response {response_delete_thing}")
-    return {"PhysicalResourceId": physical_id}
\ No newline at end of file
+    delete_vehicle(props["vehicle_name"], props["create_iot_thing"] == "true")
+    return {"PhysicalResourceId": physical_id}
@@ -1,32 +1,25 @@
 import json
 import logging as logger
-import boto3
-import os
-import time
+from clients import LazyClient
+from waiter import MANIFEST_ACTIVE, MANIFEST_INVALID, wait_for_status
 
 logger.getLogger().setLevel(logger.INFO)
 
-CUSTOM_ENDPOINT = os.getenv('FW_ENDPOINT_URL')
-if CUSTOM_ENDPOINT is None:
-    client=boto3.client('iotfleetwise')
-else:
-    session = boto3.Session()
-    session._loader.search_paths.extend([os.path.dirname(os.path.abspath(__file__)) + "/models"])
-    client = session.client("iotfleetwise", endpoint_url=CUSTOM_ENDPOINT)
+client = LazyClient('iotfleetwise')
 
 
 def on_event(event, context):
     logger.info(f"on_event {event} {context}")
     request_type = event['RequestType']
     if request_type == 'Create':
-        return on_create(event)
+        return on_create(event, context)
     if request_type == 'Update':
         return on_update(event)
     if request_type == 'Delete':
         return on_delete(event)
     raise Exception("Invalid request type: {request_type}")
 
-def on_create(event):
+def on_create(event, context):
     props = event["ResourceProperties"]
     logger.info(f"create new resource with props {props}")
     nodes = []
@@ -56,6 +49,10 @@ def on_create(event):
 
     response = client.update_model_manifest(name=props['name'], status='ACTIVE')
     logger.info(f"update_model_manifest response {response}")
+    wait_for_status(
+        lambda: client.get_model_manifest(name=props['name']),
+        MANIFEST_ACTIVE, failed=[MANIFEST_INVALID], context=context,
+        description=f"model manifest {props['name']}")
 
     signalDecoders=[
                        i
@@ -85,8 +82,10 @@ def on_create(event):
 
     response = client.update_decoder_manifest(name=props['name'], status='ACTIVE')
     logger.info(f"update_decoder_manifest response {response}")
-    time.sleep(10) #wait 10 seconds for the activation to finish.
-    logger.info(f"create_decoder_manifest response {response}")
+    wait_for_status(
+        lambda: client.get_decoder_manifest(name=props['name']),
+        MANIFEST_ACTIVE, failed=[MANIFEST_INVALID], context=context,
+        description=f"decoder manifest {props['name']}")
     return {'PhysicalResourceId': props['name']}
 
 
@@ -0,0 +1,68 @@
+import logging as logger
+import random
+import time
+
+# seconds kept before the Lambda timeout to fail the custom resource cleanly instead of being killed
+DEADLINE_MARGIN = 10.0
+# deadline when there is no Lambda context, e.g. when called locally
+DEFAULT_TIMEOUT = 120.0
+
+# FleetWise statuses
+CAMPAIGN_WAITING_FOR_APPROVAL = 'WAITING_FOR_APPROVAL'
+CAMPAIGN_RUNNING = 'RUNNING'
+CAMPAIGN_SUSPENDED = 'SUSPENDED'
+MANIFEST_ACTIVE = 'ACTIVE'
+MANIFEST_INVALID = 'INVALID'
+
+class WaiterError(Exception):
+    pass
+
+class TerminalStateError(WaiterError):
+    """The resource reached a status it will not leave for the one waited for."""
+
+    def __init__(self, description, status, response):
+        super().__init__(f"{description} is {status}: {response.get('message', response)}")
+        self.status = status
+        self.response = response
+
+class WaiterTimeoutError(WaiterError):
+    """The deadline passed before the resource reached the status waited for."""
+
+    def __init__(self, description, status, target):
+        super().__init__(f"{description} still {status} instead of {' or '.join(sorted(target))}")
+        self.status = status
+
+def deadline(context, margin=DEADLINE_MARGIN):
+    """time.monotonic() deadline leaving margin seconds of the remaining time of the Lambda invocation."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return time.monotonic() + DEFAULT_TIMEOUT
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - margin
+
+def wait_for_status(describe, target, failed=(), context=None, description='resource',
+                    initial_delay=0.1, max_delay=5.0):
+    """Call describe() until the 'status' of its response is in target, and return that response.
+
+    The delay between calls starts at initial_delay and doubles up to max_delay, with full
+    jitter. Raises TerminalStateError as soon as the status is in failed, and
+    WaiterTimeoutError if the target is not reached before the deadline of the context.
+    """
+    target = {target} if isinstance(target, str) else set(target)
+    until = deadline(context)
+    delay = initial_delay
+    attempt = 1
+    while True:
+        response = describe()
+        status = response['status']
+        if status in target:
+            logger.info(f"{description} is {status} after {attempt} calls")
+            return response
+        if status in failed:
+            raise TerminalStateError(description, status, response)
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            raise WaiterTimeoutError(description, status, target)
+        sleep = min(random.uniform(delay / 2, delay), remaining)
+        logger.info(f"{description} is {status}, checking again in {sleep:.2f}s")
+        time.sleep(sleep)
+        delay = min(delay * 2, max_delay)
+        attempt += 1
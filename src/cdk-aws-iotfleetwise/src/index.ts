@@ -1,6 +1,7 @@
 export * from './signalcatalog';
 export * from './vehiclemodel';
 export * from './vehicle';
+export * from './vehicles';
 export * from './fleet';
 export * from './campaign';
 export * from './logging';
\ No newline at end of file
@@ -123,6 +123,15 @@ export class IntegTesting {
       createIotThing: true,
     });
 
+    const simulated = new ifw.Vehicles(stack, 'SimulatedVehicles', {
+      name: 'simulated',
+      vehicleModel: model_a,
+      vehicles: Array.from({ length: 10 }, (_, i) => ({ vehicleName: `sim${i}` })),
+      createIotThing: true,
+      certificatesBucket: s3bucket,
+    });
+    new cdk.CfnOutput(stack, 'Simulated vehicles results', { value: simulated.resultsLocation! });
+
     const vpc = ec2.Vpc.fromLookup(stack, 'VPC', { isDefault: true });
 
     const securityGroup = new ec2.SecurityGroup(stack, 'SecurityGroup', {
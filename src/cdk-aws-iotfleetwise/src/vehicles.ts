@@ -0,0 +1,123 @@
+import * as cdk from 'aws-cdk-lib';
+import {
+  aws_iot as iot,
+  aws_s3 as s3,
+} from 'aws-cdk-lib';
+import { Construct } from 'constructs';
+import { Handler } from './handler';
+import { Provider } from './provider';
+import { VehicleModel } from './vehiclemodel';
+
+/**
+ * A vehicle of a bulk provisioning.
+ */
+export interface VehicleDefinition {
+  readonly vehicleName: string;
+  readonly attributes?: {[key: string]: string};
+}
+
+/**
+ * Interface
+ */
+export interface VehiclesProps {
+  readonly name: string;
+  readonly vehicleModel: VehicleModel;
+  readonly vehicles: Array<VehicleDefinition>;
+  readonly createIotThing: boolean;
+  /**
+   * Bucket receiving the certificate and private key of every vehicle and the results of the provisioning.
+   *
+   * Required with createIotThing.
+   */
+  readonly certificatesBucket?: s3.IBucket;
+  /**
+   * Key prefix of the objects written to the certificates bucket.
+   *
+   * @default - `${name}/`
+   */
+  readonly certificatesPrefix?: string;
+  readonly endpoint?: string;
+}
+
+/**
+ * Vehicles of a specific type provisioned in bulk by one resource.
+ *
+ * A vehicle that fails to be created does not fail the others, it is counted in failedCount
+ * and listed in the results object of the certificates bucket.
+ */
+export class Vehicles extends Construct {
+  public readonly vehicleModel: VehicleModel = ({} as VehicleModel);
+  public readonly vehicleNames: string[] = [];
+  public readonly createdCount: string;
+  public readonly failedCount: string;
+  public readonly endpointAddress?: string;
+  public readonly resultsLocation?: string;
+  public readonly endpoint?: string;
+
+  constructor(scope: Construct, id: string, props: VehiclesProps) {
+    super(scope, id);
+    if (props.createIotThing && !props.certificatesBucket) {
+      throw new Error('certificatesBucket is required to create the iot things of vehicles');
+    }
+    this.endpoint = props.endpoint;
+    (this.vehicleModel as VehicleModel) = props.vehicleModel;
+    (this.vehicleNames as string[]) = props.vehicles.map(v => v.vehicleName);
+
+    const handler = new Handler(this, 'Handler', {
+      handler: 'vehiclehandler.on_event',
+      endpoint: this.endpoint,
+    });
+
+    let policy: iot.CfnPolicy | undefined;
+    if (props.createIotThing) {
+      policy = new iot.CfnPolicy(this, 'Policy', {
+        policyName: `${props.name}-policy`,
+        policyDocument: {
+          Version: '2012-10-17',
+          Statement: [{
+            Effect: 'Allow',
+            Action: [
+              'iot:Connect',
+              'iot:Subscribe',
+              'iot:Publish',
+              'iot:Receive',
+            ],
+            Resource: [
+              `arn:aws:iot:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:client/\${iot:Connection.Thing.ThingName}*`,
+              `arn:aws:iot:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:topic/*`,
+              `arn:aws:iot:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:topicfilter/*`,
+            ],
+          }],
+        },
+      });
+    }
+
+    const resource = new cdk.CustomResource(this, 'Resource', {
+      serviceToken: Provider.getOrCreate(this, handler).provider.serviceToken,
+      properties: {
+        name: props.name,
+        vehicles: props.vehicles.map(v => ({
+          vehicle_name: v.vehicleName,
+          attributes: v.attributes,
+        })),
+        create_iot_thing: props.createIotThing,
+        decoder_manifest_arn: `arn:aws:iotfleetwise:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:decoder-manifest/${props.vehicleModel.name}`,
+        model_manifest_arn: `arn:aws:iotfleetwise:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:model-manifest/${props.vehicleModel.name}`,
+        certificates_bucket: props.certificatesBucket?.bucketName,
+        certificates_prefix: props.certificatesPrefix ?? `${props.name}/`,
+        policy_name: policy?.ref,
+      },
+    });
+
+    resource.node.addDependency(this.vehicleModel);
+
+    this.createdCount = resource.getAtt('created').toString();
+    this.failedCount = resource.getAtt('failed').toString();
+    if (props.createIotThing) {
+      this.endpointAddress = resource.getAtt('endpointAddress').toString();
+    }
+    if (props.certificatesBucket) {
+      this.resultsLocation = resource.getAtt('results').toString();
+    }
+  }
+}
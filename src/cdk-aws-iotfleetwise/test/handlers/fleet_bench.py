@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Check the fleet handler against a local stub client that adds a latency to every call.
+
+    python3 test/handlers/fleet_bench.py associate --vehicles 200 --latency-ms 50
+
+    python3 test/handlers/fleet_bench.py teardown --vehicles 20000 --page-size 100 --ghosts 3
+
+associate creates a fleet of --vehicles vehicles with one worker, then with FW_MAX_WORKERS
+workers, and fails unless every vehicle was associated and the concurrent run was faster.
+
+teardown deletes a fleet of --vehicles vehicles listed --page-size at a time, with tokens
+being offsets like a listing that shifts as vehicles are removed. --ghosts vehicles keep
+being listed although the service says they are not in the fleet. It fails unless the
+fleet ends up empty, and prints the number of listings and the peak memory.
+"""
+
+import argparse
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+# the handlers are bundled as the Lambda asset, keep the checks out of it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'handlers'))
+
+from botocore.exceptions import ClientError
+
+import fleethandler
+import parallel
+
+# the handlers log every call
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class StubClient:
+    """In memory FleetWise fleets, every call sleeping latency seconds like a round trip would."""
+
+    def __init__(self, latency, page_size=100, ghosts=0):
+        self.latency = latency
+        self.page_size = page_size
+        self.ghosts = [f'ghost-{i}' for i in range(ghosts)]
+        self.lock = threading.Lock()
+        self.fleets = {}
+        self.calls = 0
+        self.listings = 0
+
+    def _call(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+
+    def create_fleet(self, fleetId, description, signalCatalogArn):
+        self._call()
+        with self.lock:
+            self.fleets[fleetId] = set()
+        return {'id': fleetId}
+
+    def associate_vehicle_fleet(self, fleetId, vehicleName):
+        self._call()
+        with self.lock:
+            self.fleets[fleetId].add(vehicleName)
+        return {}
+
+    def list_vehicles_in_fleet(self, fleetId, nextToken=None):
+        self._call()
+        offset = int(nextToken or 0)
+        with self.lock:
+            if offset == 0:
+                self.listings += 1
+            listed = self.ghosts + sorted(self.fleets[fleetId])
+        response = {'vehicles': listed[offset:offset + self.page_size]}
+        if offset + self.page_size < len(listed):
+            response['nextToken'] = str(offset + self.page_size)
+        return response
+
+    def disassociate_vehicle_fleet(self, fleetId, vehicleName):
+        self._call()
+        with self.lock:
+            if vehicleName not in self.fleets[fleetId]:
+                raise ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'DisassociateVehicleFleet')
+            self.fleets[fleetId].remove(vehicleName)
+        return {}
+
+    def delete_fleet(self, fleetId):
+        self._call()
+        return {'id': fleetId}
+
+
+def create_event(fleet_id, vehicles):
+    return {
+        'RequestType': 'Create',
+        'ResourceProperties': {
+            'fleet_id': fleet_id,
+            'description': ' ',
+            'signal_catalog_arn': 'arn:aws:iotfleetwise:us-east-1:123456789012:signal-catalog/default',
+            'vehicle_names': [f'vehicle-{i}' for i in range(vehicles)],
+        },
+    }
+
+
+def associate(args):
+    stub = StubClient(args.latency_ms / 1000.0)
+    fleethandler.client = stub
+    elapsed = {}
+    for workers in (1, parallel.MAX_WORKERS):
+        fleethandler.run_concurrently = functools.partial(parallel.run_concurrently, max_workers=workers)
+        start = time.monotonic()
+        fleethandler.on_event(create_event(f'fleet-{workers}', args.vehicles), None)
+        elapsed[workers] = time.monotonic() - start
+        associated = len(stub.fleets[f'fleet-{workers}'])
+        print(f"{workers:3} workers: {args.vehicles} vehicles in {elapsed[workers]:.2f}s, {associated} associated")
+        if associated != args.vehicles:
+            return 1
+    speedup = elapsed[1] / elapsed[parallel.MAX_WORKERS]
+    print(f"speedup x{speedup:.1f}")
+    return 0 if speedup > 1 else 1
+
+
+def teardown(args):
+    stub = StubClient(args.latency_ms / 1000.0, args.page_size, args.ghosts)
+    fleethandler.client = stub
+    stub.fleets['fleet'] = {f'vehicle-{i}' for i in range(args.vehicles)}
+    event = create_event('fleet', 0)
+    event['RequestType'] = 'Delete'
+    event['PhysicalResourceId'] = 'fleet'
+    tracemalloc.start()
+    start = time.monotonic()
+    fleethandler.on_event(event, None)
+    elapsed = time.monotonic() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    left = len(stub.fleets['fleet'])
+    print(f"{args.vehicles} vehicles in {elapsed:.2f}s, {stub.listings} listings, {stub.calls} calls,"
+          f" peak {peak / 1024:.0f} KB, {left} left")
+    return 0 if left == 0 else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    associate_parser = commands.add_parser('associate', help='Time the association of the vehicles of a new fleet')
+    associate_parser.add_argument('--vehicles', type=int, default=200)
+    associate_parser.add_argument('--latency-ms', type=float, default=50, help='Latency of every stub call')
+    associate_parser.set_defaults(run=associate)
+    teardown_parser = commands.add_parser('teardown', help='Delete a fleet of many pages of vehicles')
+    teardown_parser.add_argument('--vehicles', type=int, default=20000)
+    teardown_parser.add_argument('--page-size', type=int, default=100, help='Vehicles of a listing page')
+    teardown_parser.add_argument('--ghosts', type=int, default=0, help='Vehicles listed but not in the fleet')
+    teardown_parser.add_argument('--latency-ms', type=float, default=1, help='Latency of every stub call')
+    teardown_parser.set_defaults(run=teardown)
+    args = parser.parse_args()
+    sys.exit(args.run(args))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Check the bulk mode of the vehicle handler against local stub clients that add a latency to every call.
+
+    python3 test/handlers/vehicle_bench.py --vehicles 1000 --latency-ms 20
+
+Creates --vehicles vehicles with their iot things, then deletes them. The first
+batch_create_vehicle call fails, every 7th vehicle is rejected by its batch and the
+attach of the certificate of every 13th vehicle fails. It fails unless exactly those
+vehicles are reported FAILED, the others have their certificate and key in the bucket,
+no certificate of a failed vehicle is left behind and the delete removes everything.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+# the handlers are bundled as the Lambda asset, keep the checks out of it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'handlers'))
+
+from botocore.exceptions import ClientError
+
+import vehiclehandler
+
+# the handlers log every call
+logging.getLogger().setLevel(logging.CRITICAL)
+
+
+def not_found(operation):
+    return ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, operation)
+
+
+class Stub:
+    """In memory FleetWise vehicles, IoT things and certificates and S3 objects."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.vehicles = set()
+        self.things = {}
+        self.certificates = set()
+        self.issued = 0
+        self.objects = {}
+        self.calls = 0
+        self.batch_calls = 0
+
+    def _call(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+
+    # iotfleetwise
+    def batch_create_vehicle(self, vehicles):
+        self._call()
+        with self.lock:
+            self.batch_calls += 1
+        names = [vehicle['vehicleName'] for vehicle in vehicles]
+        if 'vehicle-0' in names:
+            raise ClientError({'Error': {'Code': 'ValidationException'}}, 'BatchCreateVehicle')
+        response = {'vehicles': [], 'errors': []}
+        for name in names:
+            if int(name.split('-')[1]) % 7 == 0:
+                response['errors'].append({'vehicleName': name, 'code': '400', 'message': 'rejected'})
+                continue
+            with self.lock:
+                self.vehicles.add(name)
+                self.things[name] = set()
+            response['vehicles'].append({'vehicleName': name, 'arn': f'arn:vehicle/{name}'})
+        return response
+
+    def delete_vehicle(self, vehicleName):
+        self._call()
+        with self.lock:
+            if vehicleName not in self.vehicles:
+                raise not_found('DeleteVehicle')
+            self.vehicles.remove(vehicleName)
+        return {}
+
+    # iot
+    def describe_endpoint(self, endpointType):
+        self._call()
+        return {'endpointAddress': 'stub-ats.iot.us-east-1.amazonaws.com'}
+
+    def create_keys_and_certificate(self, setAsActive):
+        self._call()
+        with self.lock:
+            self.issued += 1
+            certificate_id = f'{self.issued:064x}'
+            self.certificates.add(certificate_id)
+        return {
+            'certificateId': certificate_id,
+            'certificateArn': f'arn:aws:iot:us-east-1:123456789012:cert/{certificate_id}',
+            'certificatePem': 'pem',
+            'keyPair': {'PrivateKey': 'key'},
+        }
+
+    def attach_thing_principal(self, thingName, principal):
+        self._call()
+        if int(thingName.split('-')[1]) % 13 == 0:
+            raise ClientError({'Error': {'Code': 'InternalFailureException'}}, 'AttachThingPrincipal')
+        with self.lock:
+            self.things[thingName].add(principal)
+        return {}
+
+    def attach_policy(self, policyName, target):
+        self._call()
+        return {}
+
+    def list_thing_principals(self, thingName, nextToken=None):
+        self._call()
+        with self.lock:
+            if thingName not in self.things:
+                raise not_found('ListThingPrincipals')
+            return {'principals': sorted(self.things[thingName])}
+
+    def detach_thing_principal(self, thingName, principal):
+        self._call()
+        with self.lock:
+            self.things.get(thingName, set()).discard(principal)
+        return {}
+
+    def update_certificate(self, certificateId, newStatus):
+        self._call()
+        return {}
+
+    def delete_certificate(self, certificateId, forceDelete):
+        self._call()
+        with self.lock:
+            if certificateId not in self.certificates:
+                raise not_found('DeleteCertificate')
+            self.certificates.remove(certificateId)
+        return {}
+
+    def delete_thing(self, thingName):
+        self._call()
+        with self.lock:
+            if thingName not in self.things:
+                raise not_found('DeleteThing')
+            del self.things[thingName]
+        return {}
+
+    # s3
+    def put_object(self, Bucket, Key, Body):
+        self._call()
+        with self.lock:
+            self.objects[Key] = Body
+        return {}
+
+
+def create_event(vehicles):
+    return {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'Vehicles',
+        'ResourceProperties': {
+            'name': 'bench',
+            'vehicles': [{'vehicle_name': f'vehicle-{i}', 'attributes': {'index': str(i)}} for i in range(vehicles)],
+            'create_iot_thing': 'true',
+            'model_manifest_arn': 'arn:model-manifest/bench',
+            'decoder_manifest_arn': 'arn:decoder-manifest/bench',
+            'certificates_bucket': 'bucket',
+            'certificates_prefix': 'bench/',
+            'policy_name': 'bench-policy',
+        },
+    }
+
+
+def expected_failures(vehicles):
+    return {f'vehicle-{i}' for i in range(vehicles)
+            if i < vehiclehandler.BATCH_CREATE_VEHICLE_SIZE or i % 7 == 0 or i % 13 == 0}
+
+
+def check(condition, message):
+    if not condition:
+        print(f"FAILED: {message}")
+    return condition
+
+
+def run(args):
+    stub = Stub(args.latency_ms / 1000.0)
+    vehiclehandler.client = stub
+    vehiclehandler.client_iot = stub
+    vehiclehandler.client_s3 = stub
+    event = create_event(args.vehicles)
+
+    start = time.monotonic()
+    response = vehiclehandler.on_event(event, None)
+    elapsed = time.monotonic() - start
+    data = response['Data']
+    results = json.loads(stub.objects['bench/results.json'])
+    failed = {name for name, result in results.items() if result['status'] == 'FAILED'}
+    created = set(results) - failed
+    expected = expected_failures(args.vehicles)
+    print(f"create: {args.vehicles} vehicles in {elapsed:.2f}s, {stub.batch_calls} batches, {stub.calls} calls,"
+          f" {data['created']} created, {data['failed']} failed")
+    ok = all([
+        check(failed == expected, f"failed vehicles {sorted(failed ^ expected)[:10]} differ"),
+        check(data['created'] == len(created) and data['failed'] == len(failed), "counts differ from the results"),
+        check(all(f'bench/{name}/certificate.pem' in stub.objects and f'bench/{name}/private-key.key' in stub.objects
+                  for name in created), "a created vehicle has no certificate or key"),
+        check(not any(f'bench/{name}/certificate.pem' in stub.objects for name in failed),
+              "a failed vehicle has a certificate"),
+        check(len(stub.certificates) == len(created), f"{len(stub.certificates) - len(created)} certificates left"),
+        check(all('error' in results[name] for name in failed), "a failed vehicle has no error"),
+        check(data['endpointAddress'] and data['results'] == 's3://bucket/bench/results.json', "missing outputs"),
+    ])
+
+    event['RequestType'] = 'Delete'
+    event['PhysicalResourceId'] = response['PhysicalResourceId']
+    start = time.monotonic()
+    vehiclehandler.on_event(event, None)
+    elapsed = time.monotonic() - start
+    print(f"delete: {elapsed:.2f}s, {len(stub.vehicles)} vehicles, {len(stub.things)} things,"
+          f" {len(stub.certificates)} certificates left")
+    ok = check(not stub.vehicles and not stub.things and not stub.certificates, "delete left resources") and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of every stub call')
+    sys.exit(run(parser.parse_args()))